@@ -7,5 +7,6 @@ setup(name="sqlitenumpy",
       license='MIT',
       url='https://github.com/jonwoodring/sqlitenumpy',
       install_requires=['numpy'],
+      entry_points={'console_scripts': ['sqlitenumpy=sqlitenumpy:main']},
       test_suite='tests'
       )
@@ -34,8 +34,26 @@ SOFTWARE.
 
 import numpy
 from csv import reader, writer
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from sqlite3 import Connection, DatabaseError, ProgrammingError, connect
+from itertools import chain, islice
+import argparse
+import glob
 import gzip
+import io
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import weakref
+import zipfile
 
 def _csv_datatype(value):
     try:
@@ -51,18 +69,22 @@ def _csv_datatype(value):
 _np_datatype = defaultdict(lambda: 'string')
 _np_datatype[numpy.dtype('float32').str] = 'real'
 _np_datatype[numpy.dtype('float64').str] = 'real'
+_np_datatype[numpy.dtype('int8').str] = 'int'
+_np_datatype[numpy.dtype('int16').str] = 'int'
 _np_datatype[numpy.dtype('int32').str] = 'int'
 _np_datatype[numpy.dtype('int64').str] = 'int'
 
 _np_convert = defaultdict(lambda: str)
 _np_convert[numpy.dtype('float32').str] = float
 _np_convert[numpy.dtype('float64').str] = float
+_np_convert[numpy.dtype('int8').str] = int
+_np_convert[numpy.dtype('int16').str] = int
 _np_convert[numpy.dtype('int32').str] = int
 _np_convert[numpy.dtype('int64').str] = int
 
-def _validate(conn, query, dtypes):
+def _validate(conn, query, dtypes, params=()):
     cursor = conn.cursor()
-    cursor.execute(query)
+    cursor.execute(query, params)
     row = cursor.fetchone()
     if row is None:
         raise ValueError('empty query result')
@@ -70,7 +92,245 @@ def _validate(conn, query, dtypes):
         raise ValueError('the length of dtypes needs to be the same as the number of columns')
     return row, cursor, [i[0] for i in cursor.description]
 
-def columnnames(conn, query):
+# the default memory budget in bytes of the query functions, None for no limit
+max_memory = None
+# if True, results over the memory budget are spilled to disk backed arrays;
+# else a MemoryError is raised, as it is when the chunks that can't be spilled
+# (columns with NULLs or mixed types) are still over the budget
+spill = False
+# if True, the MemoryError over the memory budget runs the query again to
+# count its rows and estimate the final size of the result
+count_rows = False
+# the number of rows fetched and converted to numpy arrays at a time
+fetch_size = 10000
+
+_usage = threading.local()
+
+def memoryusage():
+    """
+    Return the memory use of the last query function called on this thread,
+    as a dictionary with the peak bytes held while fetching and building the
+    result (`peak`), the number of rows (`rows`), if the result was spilled
+    to disk backed arrays (`spilled`), and a dictionary of column name to the
+    numpy data type of the columns that were downcast (`narrowed`).
+
+    *Note:* object arrays, i.e., columns with NULLs or mixed types, are only
+    counted by the size of their pointers.
+
+    :return: A dictionary of the memory use of the last query
+    :rtype: Dict[str,Any]
+    """
+    return dict(getattr(_usage, 'last', {}))
+
+def _concatenate(chunks, dtype=None):
+    if len(chunks) == 1:
+        return chunks[0] if dtype is None else chunks[0].astype(dtype)
+    try:
+        return numpy.concatenate(chunks, dtype=dtype)
+    except (TypeError, ValueError):
+        # mixed types, so let numpy infer the type over all of the values
+        return numpy.array([i for c in chunks for i in c.tolist()])
+
+def _spill(f, chunk):
+    if isinstance(chunk, tuple) or chunk.dtype == object:
+        return chunk
+    f.seek(0, os.SEEK_END)
+    offset = f.tell()
+    f.write(chunk.tobytes())
+    return (offset, chunk.dtype, chunk.shape)
+
+def _unspill(f, chunk):
+    if not isinstance(chunk, tuple):
+        return chunk
+    offset, dtype, shape = chunk
+    f.seek(offset)
+    return numpy.fromfile(f, dtype, int(numpy.prod(shape))).reshape(shape)
+
+def _memmap(f, chunks, dtype=None):
+    try:
+        if dtype is None:
+            dtype = numpy.result_type(*[i[1] if isinstance(i, tuple) else
+                i.dtype for i in chunks])
+    except TypeError:
+        dtype = numpy.dtype(object)
+    if dtype == object:
+        # object or mixed types can't be disk backed
+        return _concatenate([_unspill(f, i) for i in chunks])
+
+    shape = chunks[0][2] if isinstance(chunks[0], tuple) else chunks[0].shape
+    rows = sum(i[2][0] if isinstance(i, tuple) else len(i) for i in chunks)
+    result = numpy.memmap(tempfile.TemporaryFile(), dtype, 'w+',
+        shape=(rows,) + shape[1:])
+    start = 0
+    for i in chunks:
+        i = _unspill(f, i)
+        result[start:start + len(i)] = i
+        start = start + len(i)
+    return result
+
+def _narrowest(kinds, lo, hi, float32):
+    if len(kinds) > 0 and kinds <= {'i', 'u'}:
+        for t in [numpy.int8, numpy.int16, numpy.int32]:
+            if numpy.iinfo(t).min <= lo and hi <= numpy.iinfo(t).max:
+                return numpy.dtype(t)
+    elif float32 and 'f' in kinds and kinds <= {'i', 'u', 'f'} and \
+        max(-lo, hi) <= float(numpy.finfo(numpy.float32).max):
+        return numpy.dtype(numpy.float32)
+    return None
+
+def _blockarray(block, dtype, shape):
+    # the array holds the buffer of the memoryview of the block, so the block
+    # can't be unmapped while the array (or a view of it) is alive
+    return numpy.frombuffer(block.buf, dtype,
+        int(numpy.prod(shape))).reshape(shape)
+
+# shared memory blocks that couldn't be closed, since arrays still use them,
+# held so they aren't closed by garbage collection, and closed later
+_unclosed = []
+_unclosed_lock = threading.Lock()
+
+def _close(blocks):
+    with _unclosed_lock:
+        blocks = list(blocks) + _unclosed
+        _unclosed[:] = []
+        for i in blocks:
+            try:
+                i.close()
+            except BufferError:
+                _unclosed.append(i)
+
+def _share(chunks, dtype):
+    if dtype is None:
+        try:
+            dtype = numpy.result_type(*[i.dtype for i in chunks])
+        except TypeError:
+            dtype = numpy.dtype(object)
+    if dtype == object:
+        raise ValueError("columns with NULLs or mixed types can't be shared")
+    shape = (sum(len(i) for i in chunks),) + chunks[0].shape[1:]
+    block = SharedMemory(create=True,
+        size=max(int(numpy.prod(shape))*dtype.itemsize, 1))
+    try:
+        result = _blockarray(block, dtype, shape)
+        numpy.concatenate(chunks, out=result, casting='same_kind')
+    except BaseException:
+        result = None
+        block.unlink()
+        _close([block])
+        raise
+    return block, result
+
+def _shareall(streams, dtypes):
+    result = []
+    try:
+        for s, d in zip(streams, dtypes):
+            result.append(_share(s, d))
+    except BaseException:
+        blocks = [i[0] for i in result]
+        result = None
+        for i in blocks:
+            i.unlink()
+        _close(blocks)
+        raise
+    return result
+
+def _narrow(names, dtypes, downcast):
+    # the names of the columns that can be downcast, i.e., inferred types
+    if not downcast:
+        return None
+    return [n if d is None else None for n, d in zip(names, dtypes)]
+
+def _overbudget(conn, query, params, budget, rows, held, start):
+    elapsed = time.perf_counter() - start
+    message = 'query result exceeds max_memory of %d bytes: fetched %d rows ' \
+        'in %d bytes at %.0f rows/s, %.1f bytes per row' % \
+        (budget, rows, held, rows/max(elapsed, 1e-9), held/rows)
+    if count_rows and query is not None:
+        total = conn.execute(
+            "select count(*) from (%s)" % query, params).fetchone()[0]
+        message = message + ', estimated final size of %d rows is %d bytes' % \
+            (total, 2*held*total//rows)
+    else:
+        message = message + ', set count_rows to estimate the final size'
+    raise MemoryError(message)
+
+def _fetch(conn, query, params, row, cursor, build, budget, spilling,
+    narrow=None, float32=False, shared=False, progress=None, batch_size=None):
+    if budget is None:
+        budget = max_memory
+    if spilling is None:
+        spilling = spill
+    start = time.perf_counter()
+
+    # each stream is a column (or a row oriented array) of numpy chunks, or
+    # of the offsets of the chunks spilled to its file
+    streams = None
+    files = None
+    rows = 0
+    held = 0
+    peak = 0
+    batch = [row]
+    while len(batch) > 0:
+        arrays = build(batch)
+        if streams is None:
+            streams = [[] for i in arrays]
+            if narrow is None:
+                narrow = [None]*len(arrays)
+            kinds = [set() for i in arrays]
+            bounds = [[0, 0] for i in arrays]
+        for s, a in zip(streams, arrays):
+            s.append(a)
+        # the range of the values for downcasting, kept as the chunks arrive
+        for n, k, b, a in zip(narrow, kinds, bounds, arrays):
+            if n is not None and len(a) > 0:
+                k.add(a.dtype.kind)
+                if a.dtype.kind in 'iuf':
+                    b[0] = min(b[0], a.min().item())
+                    b[1] = max(b[1], a.max().item())
+        rows = rows + len(batch)
+        held = held + sum(a.nbytes for a in arrays)
+        peak = max(peak, held)
+
+        # the result is as large as the chunks while concatenating them
+        if budget is not None and 2*held > budget and spilling:
+            if files is None:
+                files = [tempfile.TemporaryFile() for i in streams]
+            for f, s in zip(files, streams):
+                s[:] = [_spill(f, i) for i in s]
+            held = sum(i.nbytes for s in streams for i in s
+                if not isinstance(i, tuple))
+        if budget is not None and 2*held > budget:
+            for f in files or []:
+                f.close()
+            _overbudget(conn, query, params, budget, rows, held, start)
+        if progress is not None:
+            progress(rows)
+        batch = cursor.fetchmany(fetch_size if batch_size is None else
+            batch_size)
+
+    dtypes = [None if n is None else _narrowest(k, b[0], b[1], float32)
+        for n, k, b in zip(narrow, kinds, bounds)]
+    if files is None:
+        if shared or \
+            any(len(s) > 1 or d is not None for s, d in zip(streams, dtypes)):
+            peak = 2*held
+        if shared:
+            # concatenate straight into the shared memory blocks
+            result = _shareall(streams, dtypes)
+        else:
+            result = [_concatenate(s, d) for s, d in zip(streams, dtypes)]
+    else:
+        result = [_memmap(f, s, d) for f, s, d in zip(files, streams, dtypes)]
+        for f in files:
+            f.close()
+        if shared:
+            result = _shareall([[i] for i in result], [None]*len(result))
+    _usage.last = {'peak': peak, 'rows': rows, 'spilled': files is not None,
+        'narrowed': {n: d.str for n, d in zip(narrow, dtypes)
+            if d is not None}}
+    return result
+
+def columnnames(conn, query, params=()):
     """
     Given a SQL DB-API 2.0, `conn`, return the names of the columns from a SQL
     `query` on `conn` as a list of strings.
@@ -81,14 +341,17 @@ def columnnames(conn, query):
     :param query: A SQL query on the database in `conn`
     :type query: str
 
+    :param params: Parameters to bind to the placeholders in `query`
+    :type params: Union[Sequence[Any],Dict[str,Any]] = ()
+
     :return: A list of column names
     :rtype: List[str]
     """
-    row, cursor, names = _validate(conn, query, None)
+    row, cursor, names = _validate(conn, query, None, params)
 
     return names
 
-def columnnamestypes(conn, query):
+def columnnamestypes(conn, query, params=()):
     """
     Given a SQL DB-API 2.0, `conn`, return the names and numpy data types of
     the columns from a SQL `query` on `conn` as a list of 2-tuples with strings.
@@ -99,10 +362,13 @@ def columnnamestypes(conn, query):
     :param query: A SQL query on the database in `conn`
     :type query: str
 
+    :param params: Parameters to bind to the placeholders in `query`
+    :type params: Union[Sequence[Any],Dict[str,Any]] = ()
+
     :return: A list of tuples with column names and numpy data types
     :rtype: List[Tuple[str,str]]
     """
-    row, cursor, names = _validate(conn, query, None)
+    row, cursor, names = _validate(conn, query, None, params)
 
     return [(n, t) for n, t in \
         zip(names, [numpy.array([i]).dtype.str for i in row])]
@@ -142,7 +408,9 @@ def tablenames(conn):
     return [i[0] for i in conn.execute(
     "select name from sqlite_schema where type='table' and name not like 'sqlite_%'")]
 
-def query2colarr(conn, query, dtypes=None):
+def query2colarr(conn, query, dtypes=None, params=(), max_memory=None,
+    spill=None, downcast=False, float32=False, shared=False, progress=None,
+    batch_size=None):
     """
     Given a SQL DB-API 2.0, `conn`, return the data from a SQL `query` as
     a list of numpy arrays in column order.
@@ -165,21 +433,56 @@ def query2colarr(conn, query, dtypes=None):
     :param dtypes: None or a list of numpy data types or None
     :type dtypes: Union[None,List[Union[numpy.dtype,None]]] = None
 
+    :param params: Parameters to bind to the placeholders in `query`
+    :type params: Union[Sequence[Any],Dict[str,Any]] = ()
+
+    :param max_memory: None for the module's `max_memory`, or a budget in
+      bytes for the memory used by fetching the result
+    :type max_memory: Union[None,int] = None
+
+    :param spill: None for the module's `spill`, or if True, spill a result
+      over `max_memory` to disk backed arrays instead of raising a MemoryError
+    :type spill: Union[None,bool] = None
+
+    :param downcast: If True, integer columns with an inferred data type
+      are narrowed to the smallest integer type that holds their values
+    :type downcast: bool = False
+
+    :param float32: If True and `downcast` is True, also narrow real columns
+      with an inferred data type to float32
+    :type float32: bool = False
+
+    :param shared: If True, build the columns in shared memory blocks and
+      return a `SharedColumns` handle to them
+    :type shared: bool = False
+
+    :param progress: None or a function called with the number of rows
+      fetched so far after every batch
+    :type progress: Union[None,Callable[[int],None]] = None
+
+    :param batch_size: None for the module's `fetch_size`, or the number of
+      rows fetched at a time
+    :type batch_size: Union[None,int] = None
+
     :return: A list of numpy arrays representing the query as column data
-    :rtype: List[numpy.array]
+    :rtype: Union[List[numpy.array],SharedColumns]
     """
 
-    row, cursor, names = _validate(conn, query, dtypes)
+    row, cursor, names = _validate(conn, query, dtypes, params)
     if dtypes is None:
         dtypes = [None]*len(row)
 
-    columns = [[i] for i in row]
-    for row in cursor:
-        for i, c in zip(row, columns):
-            c.append(i)
-    return [numpy.array(c, d) for c, d in zip(columns, dtypes)]
-
-def query2coldict(conn, query, dtypes=None):
+    columns = _fetch(conn, query, params, row, cursor,
+        lambda rows: [numpy.array(c, d) for c, d in zip(zip(*rows), dtypes)],
+        max_memory, spill, _narrow(names, dtypes, downcast), float32, shared,
+        progress, batch_size)
+    if shared:
+        return SharedColumns(names, columns)
+    return columns
+
+def query2coldict(conn, query, dtypes=None, params=(), max_memory=None,
+    spill=None, downcast=False, float32=False, lazy=False, shared=False,
+    progress=None, batch_size=None):
     """
     Given a SQL DB-API 2.0, `conn`, return the data from a SQL `query` as
     a dictionary of column name to numpy array.
@@ -206,22 +509,412 @@ def query2coldict(conn, query, dtypes=None):
     :param dtypes: None or a list of numpy data types or None
     :type dtypes: Union[None,List[Union[numpy.dtype,None]]] = None
 
+    :param params: Parameters to bind to the placeholders in `query`
+    :type params: Union[Sequence[Any],Dict[str,Any]] = ()
+
+    :param max_memory: None for the module's `max_memory`, or a budget in
+      bytes for the memory used by fetching the result
+    :type max_memory: Union[None,int] = None
+
+    :param spill: None for the module's `spill`, or if True, spill a result
+      over `max_memory` to disk backed arrays instead of raising a MemoryError
+    :type spill: Union[None,bool] = None
+
+    :param downcast: If True, integer columns with an inferred data type
+      are narrowed to the smallest integer type that holds their values
+    :type downcast: bool = False
+
+    :param float32: If True and `downcast` is True, also narrow real columns
+      with an inferred data type to float32
+    :type float32: bool = False
+
+    :param shared: If True, build the columns in shared memory blocks and
+      return a `SharedColumns` handle to them
+    :type shared: bool = False
+
+    :param lazy: If True, return a `LazyColdict` that only fetches the
+      columns that are used
+    :type lazy: bool = False
+
+    :param progress: None or a function called with the number of rows
+      fetched so far after every batch
+    :type progress: Union[None,Callable[[int],None]] = None
+
+    :param batch_size: None for the module's `fetch_size`, or the number of
+      rows fetched at a time
+    :type batch_size: Union[None,int] = None
+
     :return: A dictionary of column name to numpy arrays representing the
              query as column data
-    :rtype: Dict[str,numpy.array]
+    :rtype: Union[Dict[str,numpy.array],LazyColdict,SharedColumns]
     """
 
-    row, cursor, names = _validate(conn, query, dtypes)
+    if lazy and shared:
+        raise ValueError('lazy and shared cannot both be True')
+    if lazy:
+        return LazyColdict(conn, query, dtypes, params, max_memory, spill,
+            downcast, float32)
+
+    row, cursor, names = _validate(conn, query, dtypes, params)
     if dtypes is None:
         dtypes = [None]*len(row)
 
-    columns = [[i] for i in row]
-    for row in cursor:
-        for i, c in zip(row, columns):
-            c.append(i)
-    return {n: numpy.array(c, d) for c, n, d in zip(columns, names, dtypes)}
+    columns = _fetch(conn, query, params, row, cursor,
+        lambda rows: [numpy.array(c, d) for c, d in zip(zip(*rows), dtypes)],
+        max_memory, spill, _narrow(names, dtypes, downcast), float32, shared,
+        progress, batch_size)
+    if shared:
+        return SharedColumns(names, columns)
+    return {n: c for n, c in zip(names, columns)}
 
-def query2array(conn, query, dtype=None):
+def _tracker():
+    # the resource tracker process of this process, None if it has none
+    return getattr(resource_tracker._resource_tracker, '_pid', None)
+
+class SharedColumns(Mapping):
+    """
+    A handle to query columns in `multiprocessing.shared_memory` blocks,
+    returned by `query2colarr` and `query2coldict` with `shared=True`.
+
+    The handle is a dictionary of column name to numpy array, like
+    `query2coldict`, and `arrays` returns the columns in order, like
+    `query2colarr`. It pickles to the names, data types, and shapes of the
+    blocks only, so it can be passed to other processes, which attach to the
+    blocks on first access without copying the data.
+
+    The process that ran the query owns the blocks: `close` detaches the
+    calling process, and `unlink` frees the blocks once every process is
+    done with them. Using the handle as a context manager closes it on exit,
+    and unlinks the blocks in the owning process. Arrays still referenced
+    after `close` keep their blocks mapped until they're garbage collected.
+    """
+
+    def __init__(self, names, blocks):
+        self.names = names
+        self._specs = [(b.name, a.dtype.str, a.shape) for b, a in blocks]
+        self._blocks = [b for b, a in blocks]
+        self._arrays = [a for b, a in blocks]
+        self._owner = True
+        self._tracker = _tracker()
+        self._untracked = False
+
+    def __getstate__(self):
+        return {'names': self.names, 'specs': self._specs,
+            'tracker': self._tracker}
+
+    def __setstate__(self, state):
+        self.names = state['names']
+        self._specs = state['specs']
+        self._tracker = state['tracker']
+        self._blocks = None
+        self._arrays = None
+        self._owner = False
+        self._untracked = False
+
+    def _attach(self, name):
+        if sys.version_info >= (3, 13):
+            return SharedMemory(name, track=False)
+        block = SharedMemory(name)
+        # attaching registers the block with the resource tracker of this
+        # process, which unlinks it when the process exits, unless it's the
+        # tracker of the owner, which processes started by multiprocessing
+        # share
+        if os.name == 'posix' and _tracker() != self._tracker:
+            resource_tracker.unregister(block._name, 'shared_memory')
+            self._untracked = True
+        return block
+
+    def arrays(self):
+        """
+        Return the columns in the column order of the query.
+
+        :return: A list of numpy arrays in shared memory
+        :rtype: List[numpy.array]
+        """
+        if self._arrays is None:
+            self._blocks = [self._attach(n) for n, d, s in self._specs]
+            self._arrays = [_blockarray(b, numpy.dtype(d), s)
+                for b, (n, d, s) in zip(self._blocks, self._specs)]
+        return list(self._arrays)
+
+    def close(self):
+        """
+        Detach the shared memory blocks from this process.
+
+        :return: None
+        :rtype: None
+        """
+        self._arrays = None
+        if self._blocks is not None:
+            # blocks with arrays still in use are closed once they aren't
+            _close(self._blocks)
+            self._blocks = None
+
+    def unlink(self):
+        """
+        Free the shared memory blocks, after every process closed them.
+
+        :return: None
+        :rtype: None
+        """
+        blocks = self._blocks
+        if blocks is None:
+            blocks = []
+            for n, d, s in self._specs:
+                try:
+                    blocks.append(SharedMemory(n))
+                except FileNotFoundError:
+                    pass
+        for i in blocks:
+            if self._untracked:
+                # unlink unregisters the block from the tracker again
+                resource_tracker.register(i._name, 'shared_memory')
+            try:
+                i.unlink()
+            except FileNotFoundError:
+                pass
+        self._blocks = blocks
+        self.close()
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        # the right-most column with the name, like query2coldict
+        i = len(self.names) - 1 - self.names[::-1].index(name)
+        return self.arrays()[i]
+
+    def __iter__(self):
+        return iter(dict.fromkeys(self.names))
+
+    def __len__(self):
+        return len(dict.fromkeys(self.names))
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._owner:
+            self.unlink()
+        else:
+            self.close()
+
+class LazyColdict(Mapping):
+    """
+    Given a SQL DB-API 2.0, `conn`, a dictionary of column name to numpy
+    array for a SQL `query`, like `query2coldict`, that only fetches
+    a column on its first access.
+
+    The query is wrapped in a projection of the columns by position, `with
+    q(<aliases>) as (<query>) select <aliases> from q`, so SQLite only reads
+    and converts the columns that are used, and the
+    fetched columns are kept. `prefetch` fetches a set of columns with
+    a single query, for when it's known ahead which ones are needed.
+
+    *Note:* every fetch runs the query again, therefore it needs a
+    deterministic `order by` for the rows of columns fetched separately to
+    line up, since a projection can change the query plan, e.g., to use
+    a covering index.
+
+    See `query2coldict` for the parameters.
+    """
+
+    def __init__(self, conn, query, dtypes=None, params=(), max_memory=None,
+        spill=None, downcast=False, float32=False):
+        self.conn = conn
+        # a trailing ; would end the statement inside the projection
+        self.query = query.rstrip(' \t\r\n;')
+        self.params = params
+        self.max_memory = max_memory
+        self.spill = spill
+        self.downcast = downcast
+        self.float32 = float32
+        self.columns = {}
+        cursor = conn.execute("select * from (%s) limit 0" % self.query,
+            params)
+        self._names = []
+        for i in cursor.description:
+            # sqlite renames the duplicate column names of a subquery to
+            # name:N, so they're mapped back to the names of the query
+            base, colon, n = i[0].rpartition(':')
+            if colon and n.isdigit() and base in self._names:
+                self._names.append(base)
+            else:
+                self._names.append(i[0])
+        if dtypes is None:
+            dtypes = [None]*len(self._names)
+        if len(dtypes) != len(self._names):
+            raise ValueError('the length of dtypes needs to be the same as the number of columns')
+        self._dtypes = dict(zip(self._names, dtypes))
+        # the right-most column with the name, like query2coldict
+        self._index = {n: i for i, n in enumerate(self._names)}
+
+    def prefetch(self, names):
+        """
+        Fetch the columns in `names` that haven't been fetched yet, with
+        a single query.
+
+        :param names: A list of column names
+        :type names: List[str]
+
+        :return: None
+        :rtype: None
+        """
+        names = [n for n in dict.fromkeys(names) if n not in self.columns]
+        for n in names:
+            if n not in self._dtypes:
+                raise KeyError(n)
+        if len(names) == 0:
+            return
+        columns = query2colarr(self.conn,
+            "with _sqlitenumpy_lazy(%s) as (%s) select %s from "
+            "_sqlitenumpy_lazy" % (", ".join("c%d" % i for i in
+            range(len(self._names))), self.query,
+            ", ".join("c%d" % self._index[n] for n in names)),
+            [self._dtypes[n] for n in names], self.params, self.max_memory,
+            self.spill, self.downcast, self.float32)
+        self.columns.update(zip(names, columns))
+        # the narrowed columns by their names, instead of the aliases
+        aliases = {"c%d" % self._index[n]: n for n in names}
+        _usage.last['narrowed'] = {aliases[n]: d
+            for n, d in _usage.last['narrowed'].items()}
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            self.prefetch([name])
+        return self.columns[name]
+
+    def __iter__(self):
+        return iter(dict.fromkeys(self._names))
+
+    def __len__(self):
+        return len(dict.fromkeys(self._names))
+
+def _kind(value):
+    # numbers compare with each other, other types only with their own
+    if isinstance(value, (int, float)):
+        return ''
+    return type(value).__name__
+
+def _take(column, index):
+    # a spilled column stays disk backed, only the index is in memory
+    if not isinstance(column, numpy.memmap) or len(index) == 0:
+        return column[index]
+    result = numpy.memmap(tempfile.TemporaryFile(), column.dtype, 'w+',
+        shape=(len(index),) + column.shape[1:])
+    for i in range(0, len(index), fetch_size):
+        result[i:i + fetch_size] = column[index[i:i + fetch_size]]
+    return result
+
+def query2groups(conn, query, key, dtypes=None, params=(), max_memory=None,
+    spill=None, downcast=False, float32=False):
+    """
+    Given a SQL DB-API 2.0, `conn`, return the data from a SQL `query`
+    partitioned by the values of the `key` column, as a dictionary of key
+    value to a dictionary of column name to numpy array.
+
+    The query is run once and the columns are sorted by `key` in numpy (a
+    stable sort, so the query order is kept in each group), and every group
+    is a slice, i.e., a view, of the sorted columns. If the query is already
+    ordered by `key`, the columns aren't copied at all. This is faster than
+    running `query2coldict` once for every key value.
+
+    The rows with a NULL key, or NaN if `dtypes` makes `key` a float column,
+    are the group of the None key, which is a copy and is last. Keys of
+    mixed types, e.g., text and integers, are ordered by type, and then by
+    value. Spilled columns stay disk backed when they're sorted.
+
+    See `query2coldict` for `dtypes`, and the note on duplicate column names.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param query: A SQL query on the database in `conn`
+    :type query: str
+
+    :param key: The name of the column to partition by
+    :type key: str
+
+    :param dtypes: None or a list of numpy data types or None
+    :type dtypes: Union[None,List[Union[numpy.dtype,None]]] = None
+
+    :param params: Parameters to bind to the placeholders in `query`
+    :type params: Union[Sequence[Any],Dict[str,Any]] = ()
+
+    :param max_memory: None for the module's `max_memory`, or a budget in
+      bytes for the memory used by fetching the result
+    :type max_memory: Union[None,int] = None
+
+    :param spill: None for the module's `spill`, or if True, spill a result
+      over `max_memory` to disk backed arrays instead of raising a MemoryError
+    :type spill: Union[None,bool] = None
+
+    :param downcast: If True, integer columns with an inferred data type
+      are narrowed to the smallest integer type that holds their values
+    :type downcast: bool = False
+
+    :param float32: If True and `downcast` is True, also narrow real columns
+      with an inferred data type to float32
+    :type float32: bool = False
+
+    :return: A dictionary of key value to dictionaries of column name to numpy
+             arrays
+    :rtype: Dict[Any,Dict[str,numpy.array]]
+    """
+
+    columns = query2coldict(conn, query, dtypes, params, max_memory, spill,
+        downcast, float32)
+    if key not in columns:
+        raise ValueError('%s is not a column of the query' % key)
+
+    k = columns[key]
+    if k.dtype == object:
+        null = numpy.array([i is None for i in k.tolist()], bool)
+    elif k.dtype.kind == 'f':
+        null = numpy.isnan(k)
+    else:
+        null = None
+    nulls = None
+    if null is not None and null.any():
+        nulls = {n: _take(c, numpy.flatnonzero(null))
+            for n, c in columns.items()}
+        columns = {n: _take(c, numpy.flatnonzero(~null))
+            for n, c in columns.items()}
+        k = columns[key]
+
+    if k.dtype == object:
+        # mixed types, e.g., text and integers, don't compare with each
+        # other, so they're ordered by their kind and then by value
+        keys = [(_kind(i), i) for i in k.tolist()]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        if order != list(range(len(keys))):
+            columns = {n: _take(c, numpy.array(order, numpy.intp))
+                for n, c in columns.items()}
+            keys = [keys[i] for i in order]
+        starts = [i for i in range(len(keys))
+            if i == 0 or keys[i] != keys[i - 1]]
+        values = [keys[i][1] for i in starts]
+    else:
+        if len(k) > 1 and not numpy.all(k[1:] >= k[:-1]):
+            order = numpy.argsort(k, kind='stable')
+            columns = {n: _take(c, order) for n, c in columns.items()}
+            k = columns[key]
+        starts = numpy.flatnonzero(k[1:] != k[:-1]) + 1
+        if len(k) > 0:
+            starts = numpy.append(0, starts)
+        values = k[starts].tolist()
+
+    ends = numpy.append(starts[1:], len(k)).tolist()
+    groups = {v: {n: c[s:e] for n, c in columns.items()}
+        for v, s, e in zip(values, starts, ends)}
+    if nulls is not None:
+        groups[None] = nulls
+    return groups
+
+def query2array(conn, query, dtype=None, params=(), max_memory=None,
+    spill=None):
     """
     Given a SQL DB-API 2.0, `conn`, return the data from a SQL `query` as
     a 2D numpy array with a single data type.
@@ -241,18 +934,28 @@ def query2array(conn, query, dtype=None):
     :param dtype: None or a numpy data type
     :type dtypes: Union[numpy.dtype,None] = None
 
+    :param params: Parameters to bind to the placeholders in `query`
+    :type params: Union[Sequence[Any],Dict[str,Any]] = ()
+
+    :param max_memory: None for the module's `max_memory`, or a budget in
+      bytes for the memory used by fetching the result
+    :type max_memory: Union[None,int] = None
+
+    :param spill: None for the module's `spill`, or if True, spill a result
+      over `max_memory` to disk backed arrays instead of raising a MemoryError
+    :type spill: Union[None,bool] = None
+
     :return: A 2D numpy array with a single data type
     :rtype: 2D numpy.array
     """
 
-    row, cursor, names = _validate(conn, query, None)
+    row, cursor, names = _validate(conn, query, None, params)
 
-    rows = [row]
-    for row in cursor:
-        rows.append(row)
-    return numpy.array(rows, dtype)
+    return _fetch(conn, query, params, row, cursor,
+        lambda rows: [numpy.array(rows, dtype)], max_memory, spill)[0]
 
-def query2struct(conn, query, dtypes):
+def query2struct(conn, query, dtypes, params=(), max_memory=None,
+    spill=None):
     """
     Given a SQL DB-API 2.0, `conn`, return the data from a SQL `query` as
     a 2D numpy structured array.
@@ -279,25 +982,350 @@ def query2struct(conn, query, dtypes):
     :param dtypes: A list of numpy data types
     :type dtypes: List[numpy.dtype]
 
+    :param params: Parameters to bind to the placeholders in `query`
+    :type params: Union[Sequence[Any],Dict[str,Any]] = ()
+
+    :param max_memory: None for the module's `max_memory`, or a budget in
+      bytes for the memory used by fetching the result
+    :type max_memory: Union[None,int] = None
+
+    :param spill: None for the module's `spill`, or if True, spill a result
+      over `max_memory` to disk backed arrays instead of raising a MemoryError
+    :type spill: Union[None,bool] = None
+
     :return: A 1D structured numpy array with data types for each column
     :rtype: 1D structured numpy.array
     """
 
-    row, cursor, names = _validate(conn, query, dtypes)
+    row, cursor, names = _validate(conn, query, dtypes, params)
     if dtypes is None:
         dtypes = [None]*len(row)
 
-    rows = [row]
-    for row in cursor:
-        rows.append(row)
-    return numpy.array(rows, [(n, d) for n, d in zip(names, dtypes)])
+    dtype = [(n, d) for n, d in zip(names, dtypes)]
+    return _fetch(conn, query, params, row, cursor,
+        lambda rows: [numpy.array(rows, dtype)], max_memory, spill)[0]
+
+class _Rows:
+    # the fetchmany of a cursor over an iterator of rows, for _fetch
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchmany(self, size):
+        return list(islice(self.rows, size))
+
+def _querymany(conn, query, params, dtypes):
+    cursor = conn.cursor()
+    names = []
+    groups = [0]
+
+    def rows():
+        # the ordinal of the parameter set is appended to every row
+        for p in params:
+            cursor.execute(query, p)
+            if len(names) == 0:
+                names.extend(i[0] for i in cursor.description)
+            for row in cursor:
+                yield row + (groups[0],)
+            groups[0] = groups[0] + 1
+
+    rows = _Rows(rows())
+    row = next(rows.rows, None)
+    if row is None:
+        raise ValueError('empty query result')
+    if dtypes is None:
+        dtypes = [None]*len(names)
+    elif len(dtypes) != len(names):
+        raise ValueError('the length of dtypes needs to be the same as the number of columns')
+
+    # the rows go through the memory budget like the other query functions,
+    # without counting them again for the MemoryError
+    columns = _fetch(conn, None, None, row, rows,
+        lambda rows: [numpy.array(c, d) for c, d in
+            zip(zip(*rows), dtypes + [numpy.int64])], None, None)
+    group = columns.pop()
+    bounds = numpy.searchsorted(group, numpy.arange(1, groups[0]))
+    return names, columns, group, bounds
+
+def querymany2colarr(conn, query, params, dtypes=None, split=False):
+    """
+    Given a SQL DB-API 2.0, `conn`, run a SQL `query` once for every set of
+    parameters in `params` and return the data as a list of numpy arrays in
+    column order, like `query2colarr`.
+
+    The same query string is executed for every parameter set, so it is only
+    parsed and planned once by the connection's statement cache, i.e., use
+    this for point lookups instead of formatting the values into the query in
+    a loop. The rows are fetched within the module's `max_memory`, like
+    `query2colarr`.
+
+    If `split` is False, the rows of all the parameter sets are concatenated
+    and returned with a group index array, holding the ordinal of the
+    parameter set that produced each row. If `split` is True, a list with
+    the column arrays of each parameter set is returned instead; parameter
+    sets without any rows get empty arrays.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param query: A SQL query on the database in `conn`
+    :type query: str
+
+    :param params: An iterable of parameters to bind to the placeholders in
+      `query`
+    :type params: Iterable[Union[Sequence[Any],Dict[str,Any]]]
+
+    :param dtypes: None or a list of numpy data types or None
+    :type dtypes: Union[None,List[Union[numpy.dtype,None]]] = None
+
+    :param split: If True, return a list of results, one per parameter set
+    :type split: bool = False
+
+    :return: A 2-tuple of a list of numpy arrays and the group index array,
+      or if `split` is True, a list of lists of numpy arrays
+    :rtype: Union[Tuple[List[numpy.array],numpy.array],List[List[numpy.array]]]
+    """
+
+    names, columns, group, bounds = _querymany(conn, query, params, dtypes)
+    if not split:
+        return columns, group
+
+    return [list(i) for i in
+        zip(*[numpy.split(c, bounds) for c in columns])]
+
+def querymany2coldict(conn, query, params, dtypes=None, split=False):
+    """
+    Given a SQL DB-API 2.0, `conn`, run a SQL `query` once for every set of
+    parameters in `params` and return the data as a dictionary of column name
+    to numpy array, like `query2coldict`.
+
+    See `querymany2colarr` for how the results of each parameter set are
+    concatenated with a group index, or split when `split` is True.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param query: A SQL query on the database in `conn`
+    :type query: str
+
+    :param params: An iterable of parameters to bind to the placeholders in
+      `query`
+    :type params: Iterable[Union[Sequence[Any],Dict[str,Any]]]
+
+    :param dtypes: None or a list of numpy data types or None
+    :type dtypes: Union[None,List[Union[numpy.dtype,None]]] = None
+
+    :param split: If True, return a list of results, one per parameter set
+    :type split: bool = False
+
+    :return: A 2-tuple of a dictionary of column name to numpy arrays and the
+      group index array, or if `split` is True, a list of dictionaries
+    :rtype: Union[Tuple[Dict[str,numpy.array],numpy.array],List[Dict[str,numpy.array]]]
+    """
+
+    names, columns, group, bounds = _querymany(conn, query, params, dtypes)
+    if not split:
+        return {n: c for n, c in zip(names, columns)}, group
+
+    return [{n: c for n, c in zip(names, i)} for i in
+        zip(*[numpy.split(c, bounds) for c in columns])]
+
+def _sample(conn, table, n, fraction, columns, seed):
+    if (n is None) == (fraction is None):
+        raise ValueError('exactly one of n or fraction needs to be given')
+
+    # separate queries, since sqlite only optimizes a lone min or max into
+    # a b-tree lookup instead of a scan
+    lo = conn.execute("select min(rowid) from '%s'" % table).fetchone()[0]
+    hi = conn.execute("select max(rowid) from '%s'" % table).fetchone()[0]
+    if lo is None:
+        raise ValueError('empty query result')
+    span = hi - lo + 1
+    rng = numpy.random.default_rng(seed)
+
+    transaction = conn.in_transaction
+    cursor = conn.cursor()
+    cursor.execute("create temp table if not exists _sqlitenumpy_sample "
+        "(id integer primary key)")
+    cursor.execute("delete from temp._sqlitenumpy_sample")
+    insertstr = "insert or ignore into temp._sqlitenumpy_sample values (?)"
+    hitstr = "select rowid from '%s' where rowid in " \
+        "(select id from temp._sqlitenumpy_sample)" % table
+
+    if fraction is not None:
+        # every rowid in the range is picked with the same probability, so
+        # gaps from deleted rows don't bias the sample, a block of the range
+        # at a time to bound the memory
+        for start in range(lo, hi + 1, 2**20):
+            m = min(2**20, hi + 1 - start)
+            ids = numpy.flatnonzero(rng.random(m) < fraction) + start
+            cursor.executemany(insertstr, ((i,) for i in ids.tolist()))
+    else:
+        # draw rowids until enough of them hit existing rows, oversampling
+        # by the hit rate seen so far
+        hits = numpy.array([], numpy.int64)
+        tried = 0
+        while len(hits) < n and tried < span:
+            rate = len(hits)/tried if tried > 0 else 1.0
+            k = int((n - len(hits))/max(rate, 0.01)*1.1) + 1
+            if 2*(tried + k) >= span:
+                cursor.execute(insertstr.replace("values (?)",
+                    "select rowid from '%s'" % table))
+                tried = span
+            else:
+                cursor.executemany(insertstr,
+                    ((int(i),) for i in rng.integers(lo, hi + 1, k)))
+                tried = cursor.execute(
+                    "select count(*) from temp._sqlitenumpy_sample").fetchone()[0]
+            hits = numpy.array([i[0] for i in cursor.execute(hitstr)],
+                numpy.int64)
+        if len(hits) > n:
+            cursor.execute("delete from temp._sqlitenumpy_sample")
+            cursor.executemany(insertstr,
+                ((int(i),) for i in rng.choice(hits, n, replace=False)))
+
+    if columns is None:
+        columnstr = "*"
+    else:
+        columnstr = ", ".join('"%s"' % i for i in columns)
+    return "select %s from '%s' where rowid in " \
+        "(select id from temp._sqlitenumpy_sample) order by rowid" % \
+        (columnstr, table), transaction
+
+def _sample_done(conn, transaction):
+    conn.execute("delete from temp._sqlitenumpy_sample")
+    if not transaction:
+        conn.commit()
+
+def sample2colarr(conn, table, n=None, fraction=None, columns=None,
+    dtypes=None, seed=None):
+    """
+    Given a SQL DB-API 2.0, `conn`, return a random sample of the rows of
+    a `table` as a list of numpy arrays in column order, like `query2colarr`.
+
+    Either a fixed number of rows, `n`, or a `fraction` of the rows is
+    sampled. The rowids are picked at random in numpy and only those rows are
+    fetched, in rowid order, through a temporary table of the picked rowids,
+    i.e., the table is never sorted or scanned like with `order by random()`.
+    A `fraction` picks every rowid with the same probability, so the number
+    of rows returned is only approximately that fraction of the table.
+
+    *Note:* `table` needs to be a rowid table, i.e., not `without rowid`.
+    A temporary table is used to hold the sample, therefore a transaction is
+    committed if one wasn't open already.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param table: A SQL table on the database in `conn`
+    :type table: str
+
+    :param n: None or the number of rows to sample
+    :type n: Union[None,int] = None
+
+    :param fraction: None or the fraction of the rows to sample
+    :type fraction: Union[None,float] = None
+
+    :param columns: None for all the columns of `table`, or a list of column
+      names
+    :type columns: Union[None,List[str]] = None
+
+    :param dtypes: None or a list of numpy data types or None
+    :type dtypes: Union[None,List[Union[numpy.dtype,None]]] = None
+
+    :param seed: None or a seed for the numpy random number generator
+    :type seed: Union[None,int] = None
+
+    :return: A list of numpy arrays representing the sample as column data
+    :rtype: List[numpy.array]
+    """
+
+    query, transaction = _sample(conn, table, n, fraction, columns, seed)
+    try:
+        return query2colarr(conn, query, dtypes)
+    finally:
+        _sample_done(conn, transaction)
+
+def sample2coldict(conn, table, n=None, fraction=None, columns=None,
+    dtypes=None, seed=None):
+    """
+    Given a SQL DB-API 2.0, `conn`, return a random sample of the rows of
+    a `table` as a dictionary of column name to numpy array, like
+    `query2coldict`.
+
+    See `sample2colarr` for how the rows are sampled.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param table: A SQL table on the database in `conn`
+    :type table: str
+
+    :param n: None or the number of rows to sample
+    :type n: Union[None,int] = None
+
+    :param fraction: None or the fraction of the rows to sample
+    :type fraction: Union[None,float] = None
+
+    :param columns: None for all the columns of `table`, or a list of column
+      names
+    :type columns: Union[None,List[str]] = None
+
+    :param dtypes: None or a list of numpy data types or None
+    :type dtypes: Union[None,List[Union[numpy.dtype,None]]] = None
+
+    :param seed: None or a seed for the numpy random number generator
+    :type seed: Union[None,int] = None
+
+    :return: A dictionary of column name to numpy arrays representing the
+             sample as column data
+    :rtype: Dict[str,numpy.array]
+    """
+
+    query, transaction = _sample(conn, table, n, fraction, columns, seed)
+    try:
+        return query2coldict(conn, query, dtypes)
+    finally:
+        _sample_done(conn, transaction)
+
+# the characters a formatted int or real can have, which csv.writer would
+# quote if one of them is a delimiter, quotechar, or in the lineterminator
+_numeric = set('0123456789+-. eEinfaINFA')
+
+def _csvblock(rows, float_format, delimiter=',', quotechar='"',
+    lineterminator='\r\n'):
+    # formats a batch of rows with a single format string for the whole
+    # batch if every column only has int, or only has real values, since
+    # those never need quoting; otherwise returns None for csv.writer
+    values = tuple(chain.from_iterable(rows))
+    n = len(rows[0])
+    formats = []
+    for i in range(n):
+        types = set(map(type, values[i::n]))
+        if types == {int}:
+            formats.append('%d')
+        elif types == {float}:
+            formats.append('%r' if float_format is None else float_format)
+        else:
+            return None
+
+    rowstr = delimiter.replace('%', '%%').join(formats) + \
+        lineterminator.replace('%', '%%')
+    return (rowstr*len(rows)) % values
 
 def query2csv(conn, query, filename, header_skip=False, csv_options={},
-    encoding='utf-8'):
+    encoding='utf-8', params=(), progress=None, float_format=None,
+    batch_size=None):
     """
     Given a SQL DB-API 2.0, `conn`, write the data from a SQL `query` into
     a CSV file named `filename`.
 
+    The rows are fetched in batches and, unless `csv_options` has other
+    options than `delimiter`, `quotechar`, or `lineterminator`, a batch where
+    every column only has int, or only has real values is formatted with
+    a single format string for the whole batch and written in one call,
+    since those values never need quoting. Other batches are written with
+    a `csv.writer`, so the output is the same as writing every row with it.
+
     :param conn: A database connection object
     :type conn: SQL DB-API 2.0 object
 
@@ -316,27 +1344,68 @@ def query2csv(conn, query, filename, header_skip=False, csv_options={},
     :param encoding: Encoding of the CSV file
     :type encoding: str = 'utf-8'
 
-    :return: None
-    :rtype: None
-    """
+    :param params: Parameters to bind to the placeholders in `query`
+    :type params: Union[Sequence[Any],Dict[str,Any]] = ()
+
+    :param progress: None or a function called with the number of rows
+      written so far after every batch
+    :type progress: Union[None,Callable[[int],None]] = None
+
+    :param float_format: None to write real values like `repr`, or a printf
+      style format for them, e.g., '%.6f' or '%.8g'; can't be used with other
+      `csv_options` than `delimiter`, `quotechar`, or `lineterminator`
+    :type float_format: Union[None,str] = None
+
+    :param batch_size: None for the module's `fetch_size`, or the number of
+      rows fetched at a time
+    :type batch_size: Union[None,int] = None
 
-    row, cursor, names = _validate(conn, query, None)
+    :return: The number of rows written
+    :rtype: int
+    """
 
-    columns = [[i] for i in row]
-    for row in cursor:
-        for i, c in zip(row, columns):
-            c.append(i)
+    if batch_size is None:
+        batch_size = fetch_size
+    fast = set(csv_options) <= {'delimiter', 'quotechar', 'lineterminator'}
+    if not fast and float_format is not None:
+        raise ValueError('float_format can only be used with the delimiter, '
+            'quotechar, and lineterminator csv_options')
+    row, cursor, names = _validate(conn, query, None, params)
 
     f = open(filename, 'w', encoding=encoding)
-    w = writer(f, **csv_options)
+    out = writer(f, **csv_options)
+    if fast:
+        special = dict({'delimiter': ',', 'quotechar': '"',
+            'lineterminator': '\r\n'}, **csv_options).values()
+        fast = _numeric.union(float_format or '').isdisjoint(
+            ''.join(v for v in special if v))
+    def write(batch):
+        block = _csvblock(batch, float_format, **csv_options) \
+            if fast else None
+        if block is not None:
+            f.write(block)
+        elif float_format is not None:
+            out.writerows([float_format % v if type(v) is float else v
+                for v in r] for r in batch)
+        else:
+            out.writerows(batch)
     if not header_skip:
-      w.writerow(names)
-    for row in zip(*columns):
-        w.writerow(row)
+        out.writerow(names)
+    batch = [row]
+    rows = 0
+    while len(batch) > 0:
+        write(batch)
+        rows = rows + len(batch)
+        if progress is not None:
+            progress(rows)
+        batch = cursor.fetchmany(batch_size)
     f.close()
 
+    return rows
+
 def csv2sqlite(conn, table, filename, header_skip=False,
-    csv_options={}, encoding='utf-8', header=None, gzipped=False):
+    csv_options={}, encoding='utf-8', header=None, gzipped=False,
+    batch_size=10000, progress=None):
     """
     Given a SQL DB-API 2.0, `conn`, inject the data from a CSV `filename` into
     the database with the `table` name.
@@ -365,6 +1434,16 @@ def csv2sqlite(conn, table, filename, header_skip=False,
       names if `header_skip` is True
     :type header: Union[None,List[str]]
 
+    :param gzipped: If True, the CSV file is gzip compressed
+    :type gzipped: bool = False
+
+    :param batch_size: The number of rows to insert at a time
+    :type batch_size: int = 10000
+
+    :param progress: None or a function called with the number of rows
+      inserted so far after every batch
+    :type progress: Union[None,Callable[[int],None]] = None
+
     :return: A list of 2-tuples of column names and SQL data types
     :rtype: List[Tuple[str,str]]
     """
@@ -373,19 +1452,24 @@ def csv2sqlite(conn, table, filename, header_skip=False,
       f = gzip.open(filename, 'rt', encoding=encoding)
     else:
       f = open(filename, 'r', encoding=encoding)
-    r = reader(f, **csv_options)
+    try:
+        return _csv2sqlite(conn, table, reader(f, **csv_options), header_skip,
+            header, batch_size, progress)
+    finally:
+        f.close()
 
+def _csv2sqlite(conn, table, r, header_skip, header, batch_size, progress):
     if header_skip:
         if header is None:
             raise ValueError('header cannot be None when header_skip is True')
         columns = header
+        row = next(r, None)
     else:
-        if header is None:
-            columns = next(r)
-        else:
-            next(r)
-            columns = header
-    row = next(r)
+        first = next(r, None)
+        columns = first if header is None else header
+        row = None if first is None else next(r, None)
+    if row is None:
+        raise ValueError('empty csv input, no rows after the header')
     types = [_csv_datatype(i) for i in row]
 
     cursor = conn.cursor()
@@ -398,10 +1482,16 @@ def csv2sqlite(conn, table, filename, header_skip=False,
     insertstr = insertstr + ")"
     cursor.execute("create table '%s' (%s)" % (table, columnstr))
     cursor.execute(insertstr, row)
-    for row in r:
-        cursor.execute(insertstr, row)
+    rows = 1
+    while True:
+        if progress is not None:
+            progress(rows)
+        batch = list(islice(r, batch_size))
+        if len(batch) == 0:
+            break
+        cursor.executemany(insertstr, batch)
+        rows = rows + len(batch)
     conn.commit()
-    f.close()
 
     return list(zip(columns, types))
 
@@ -450,8 +1540,1030 @@ def columns2sqlite(conn, table, columns, header):
         insertstr = insertstr + ", ?"
     insertstr = insertstr + ")"
     cursor.execute("create table '%s' (%s)" % (table, columnstr))
-    for row in zip(*[columns[i] for i in idx]):
-        cursor.execute(insertstr, [c(v) for c, v in zip(conv, row)])
+    cursor.executemany(insertstr, ([c(v) for c, v in zip(conv, row)]
+        for row in zip(*[columns[i] for i in idx])))
     conn.commit()
 
     return list(zip(names, types))
+
+def _append(buffer, size, chunk):
+    if buffer is None:
+        buffer = numpy.empty(max(len(chunk), 1024), chunk.dtype)
+    elif buffer.dtype != chunk.dtype:
+        buffer = buffer.astype(numpy.promote_types(buffer.dtype, chunk.dtype))
+    if size + len(chunk) > len(buffer):
+        grown = numpy.empty(max(2*len(buffer), size + len(chunk)), buffer.dtype)
+        grown[:size] = buffer[:size]
+        buffer = grown
+    buffer[size:size + len(chunk)] = chunk
+    return buffer
+
+class LiveColdict(Mapping):
+    """
+    Given a SQL DB-API 2.0, `conn`, follow the tail of a growing `table` as
+    a dictionary of column name to numpy array, like `query2coldict`.
+
+    The highest value of the monotonic `key` column seen so far is remembered,
+    and `refresh` only fetches the rows with a larger `key`, appending them to
+    the column arrays. The arrays grow by doubling, so a refresh costs time
+    proportional to the new rows rather than the size of the table. The arrays
+    handed out are views of the current rows; take a copy if they need to
+    outlive the next refresh.
+
+    *Note:* rows that are updated or deleted behind the tail are not seen
+    again, i.e., `table` is expected to be append only. The new rows are fetched
+    within the module's `max_memory`, but never spilled, since the arrays are
+    kept in memory.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param table: A SQL table on the database in `conn`
+    :type table: str
+
+    :param columns: None for all the columns of `table`, or a list of column
+      names
+    :type columns: Union[None,List[str]] = None
+
+    :param key: A column that increases with every inserted row
+    :type key: str = 'rowid'
+
+    :param dtypes: None or a list of numpy data types or None
+    :type dtypes: Union[None,List[Union[numpy.dtype,None]]] = None
+    """
+
+    def __init__(self, conn, table, columns=None, key='rowid', dtypes=None):
+        if columns is None:
+            columns = [i[0] for i in tableschema(conn, table)]
+        if dtypes is None:
+            dtypes = [None]*len(columns)
+        if len(dtypes) != len(columns):
+            raise ValueError('the length of dtypes needs to be the same as the number of columns')
+
+        self.conn = conn
+        self.table = table
+        self.key = key
+        self.last = None
+        self.rows = 0
+        self._names = columns
+        self._dtypes = dtypes
+        self._buffers = [None]*len(columns)
+        self._select = "select %s, %s from '%s'" % \
+            (key, ", ".join('"%s"' % i for i in columns), table)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Fetch the rows that were appended to the table since the last refresh.
+
+        :return: The number of new rows
+        :rtype: int
+        """
+        if self.last is None:
+            query = "%s order by %s" % (self._select, self.key)
+            params = ()
+        else:
+            query = "%s where %s > ? order by %s" % \
+                (self._select, self.key, self.key)
+            params = (self.last,)
+        cursor = self.conn.execute(query, params)
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+
+        # the arrays are kept in memory, so they're never spilled
+        columns = _fetch(self.conn, query, params, row, cursor,
+            lambda rows: [numpy.array(c, d) for c, d in
+                zip(zip(*rows), [None] + self._dtypes)], None, False)
+        self.last = columns[0][-1].item()
+        for i, c in enumerate(columns[1:]):
+            self._buffers[i] = _append(self._buffers[i], self.rows, c)
+        self.rows = self.rows + len(columns[0])
+        return len(columns[0])
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        i = self._names.index(name)
+        if self._buffers[i] is None:
+            return numpy.array([], self._dtypes[i])
+        return self._buffers[i][:self.rows]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+_sql_dtype = defaultdict(lambda: '<U1')
+_sql_dtype['int'] = numpy.dtype('int64').str
+_sql_dtype['integer'] = numpy.dtype('int64').str
+_sql_dtype['real'] = numpy.dtype('float64').str
+
+def _table2coldict(conn, table):
+    schema = tableschema(conn, "'%s'" % table)
+    # columns with more than one storage class (NULLs included) would be
+    # converted to a single numpy type, and numpy strips the trailing zero
+    # bytes of byte strings, so both are kept as python objects
+    row = conn.execute("select %s from '%s'" % (", ".join(
+        "count(distinct typeof(\"%s\")) > 1 or max(typeof(\"%s\") = 'blob')"
+        % (n, n) for n, t in schema), table)).fetchone()
+    try:
+        return query2coldict(conn, "select * from '%s'" % table,
+            [object if i else None for i in row])
+    except ValueError:
+        return {n: numpy.array([], _sql_dtype[t]) for n, t in schema}
+
+def _schema(conn, table):
+    # the table first, then its indexes and triggers
+    return [i[0] for i in conn.execute(
+        "select sql from sqlite_schema where tbl_name = ? and sql is not null "
+        "order by type != 'table'", (table,))]
+
+def _rows(columns, size):
+    # python values, i.e., None and bytes stay as they are, a slice at a time
+    for i in range(0, len(columns[0]), size):
+        yield from zip(*[c[i:i + size].tolist() for c in columns])
+
+def _quote(name):
+    # table and column names in file names and keys, with / and . escaped
+    return urllib.parse.quote(name, safe='').replace('.', '%2E')
+
+def _database(conn):
+    for i in conn.execute("pragma database_list"):
+        if i[1] == 'main':
+            return i[2]
+    return ''
+
+def db2npz(conn, filename, tables=None, compressed=True, threads=None):
+    """
+    Given a SQL DB-API 2.0, `conn`, export the columns of the tables in `conn`
+    as numpy arrays to a `.npz` file or a directory of `.npy` files.
+
+    If `filename` ends with `.npz`, the arrays are written to a single zip
+    file with the keys `table/column`, else `filename` is a directory with
+    a subdirectory for each table, holding `ordinal.column.npy` files. The
+    names are percent encoded, e.g., a `/` in a name is `%2F`. The
+    arrays keep the numpy data types that `query2coldict` returns, so
+    nothing is formatted as text, and `npz2db` restores them. The SQL schema
+    of each table, with its indexes and triggers, is saved as `.schema.npy`
+    next to its columns.
+
+    If the database is a file, the tables are fetched concurrently with
+    `threads` connections of their own, with the 'analytical-read' profile,
+    and at most `threads` tables are held in memory; an in-memory database is
+    exported one table at a time on `conn`.
+
+    *Note:* columns with NULLs or blobs are object arrays, which are pickled,
+    see `allow_pickle` in `npz2db`.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param filename: The `.npz` file or directory to write the arrays to
+    :type filename: str
+
+    :param tables: None for all tables, or a list of table names
+    :type tables: Union[None,List[str]] = None
+
+    :param compressed: If True, compress the `.npz` file
+    :type compressed: bool = True
+
+    :param threads: None for the default number of threads or the number of
+      threads fetching tables
+    :type threads: Union[None,int] = None
+
+    :return: A list of the table names that were exported
+    :rtype: List[str]
+    """
+
+    if tables is None:
+        tables = tablenames(conn)
+    database = _database(conn)
+
+    def fetch(table):
+        if database == '':
+            return table, _schema(conn, table), _table2coldict(conn, table)
+        c = connection(database, 'analytical-read')
+        try:
+            return table, _schema(c, table), _table2coldict(c, table)
+        finally:
+            c.close()
+
+    def save(name, array):
+        if z is None:
+            numpy.save(os.path.join(filename, name), array, allow_pickle=True)
+        else:
+            with z.open(name, 'w', force_zip64=True) as f:
+                numpy.lib.format.write_array(f, array, allow_pickle=True)
+
+    def write(table, schema, columns):
+        table = _quote(table)
+        if z is None:
+            os.makedirs(os.path.join(filename, table), exist_ok=True)
+            save(os.path.join(table, '.schema.npy'), numpy.array(schema, str))
+            for i, (n, c) in enumerate(columns.items()):
+                save(os.path.join(table, '%d.%s.npy' % (i, _quote(n))), c)
+        else:
+            save('%s/.schema.npy' % table, numpy.array(schema, str))
+            for n, c in columns.items():
+                save('%s/%s.npy' % (table, _quote(n)), c)
+
+    if filename.endswith('.npz'):
+        z = zipfile.ZipFile(filename, 'w', allowZip64=True,
+            compression=zipfile.ZIP_DEFLATED if compressed else
+            zipfile.ZIP_STORED)
+    else:
+        z = None
+
+    pool = None
+    try:
+        if database == '':
+            for t in tables:
+                write(*fetch(t))
+        else:
+            if threads is None:
+                threads = min(32, (os.cpu_count() or 1) + 4)
+            pool = ThreadPoolExecutor(threads)
+            # only submit a table when one is written, so that the fetched
+            # tables waiting to be written don't pile up in memory
+            queued = iter(tables)
+            pending = {pool.submit(fetch, t) for t in islice(queued, threads)}
+            while len(pending) > 0:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    write(*f.result())
+                    pending.update(pool.submit(fetch, t)
+                        for t in islice(queued, 1))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if z is not None:
+            z.close()
+
+    return tables
+
+def npz2db(conn, filename, tables=None, allow_pickle=False):
+    """
+    Given a SQL DB-API 2.0, `conn`, create and fill tables from the numpy
+    arrays in a `.npz` file or a directory of `.npy` files written by
+    `db2npz`.
+
+    The tables are created from their saved SQL schema, therefore they must
+    not exist already in `conn`, and their indexes and triggers are created
+    after the rows are inserted. Files without a saved schema are inserted
+    with `columns2sqlite`.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param filename: The `.npz` file or directory to read the arrays from
+    :type filename: str
+
+    :param tables: None for all tables, or a list of table names
+    :type tables: Union[None,List[str]] = None
+
+    :param allow_pickle: If True, allow loading object arrays (columns with
+      NULLs or blobs), which unpickles data from `filename`; only use with
+      trusted files
+    :type allow_pickle: bool = False
+
+    :return: A dictionary of table name to a list of 2-tuples of column names
+      and SQL data types
+    :rtype: Dict[str,List[Tuple[str,str]]]
+    """
+
+    columns = {}
+    schemas = {}
+    if filename.endswith('.npz'):
+        z = numpy.load(filename, allow_pickle=allow_pickle)
+        try:
+            for k in z.files:
+                t, n = k.split('/')
+                t = urllib.parse.unquote(t)
+                if tables is not None and t not in tables:
+                    continue
+                if n == '.schema':
+                    schemas[t] = z[k].tolist()
+                else:
+                    columns.setdefault(t, {})[urllib.parse.unquote(n)] = z[k]
+        finally:
+            z.close()
+    else:
+        for d in sorted(os.listdir(filename)):
+            t = urllib.parse.unquote(d)
+            if tables is not None and t not in tables:
+                continue
+            files = os.listdir(os.path.join(filename, d))
+            if '.schema.npy' in files:
+                files.remove('.schema.npy')
+                schemas[t] = numpy.load(
+                    os.path.join(filename, d, '.schema.npy')).tolist()
+            files.sort(key=lambda i: int(i.split('.', 1)[0]))
+            columns[t] = {urllib.parse.unquote(i.split('.')[1]):
+                numpy.load(os.path.join(filename, d, i),
+                    allow_pickle=allow_pickle) for i in files}
+
+    result = {}
+    for t, c in columns.items():
+        if t not in schemas:
+            result[t] = columns2sqlite(conn, t, c, list(c.keys()))
+            continue
+        conn.execute(schemas[t][0])
+        conn.executemany('insert into "%s" (%s) values (%s)' %
+            (t, ', '.join('"%s"' % n for n in c), ', '.join('?'*len(c))),
+            _rows(list(c.values()), fetch_size))
+        for i in schemas[t][1:]:
+            conn.execute(i)
+        conn.commit()
+        result[t] = tableschema(conn, "'%s'" % t)
+    return result
+
+# named sets of pragmas for `connection` and `ReadPool`; negative cache sizes
+# are in KiB
+profiles = {
+    # large transactions with no fsyncs, i.e., a crash can lose the load
+    'bulk-load': {'journal_mode': 'wal', 'synchronous': 'off',
+        'cache_size': -262144, 'temp_store': 'memory'},
+    # memory mapped reads with a large page cache and temporary b-trees
+    # (sorts, distinct, group by) in memory
+    'analytical-read': {'mmap_size': 2**30, 'cache_size': -262144,
+        'temp_store': 'memory'},
+    'low-memory': {'mmap_size': 0, 'cache_size': -2048, 'temp_store': 'file'},
+}
+
+class _Connection(Connection):
+    # unlike sqlite3.Connection, it can be weakly referenced, e.g., by the
+    # columnstats cache
+    pass
+
+def connection(database, profile=None, pragmas={}, **kwargs):
+    """
+    Open a SQLite `database` file and set the pragmas of a named `profile`,
+    from the module's `profiles`, followed by the `pragmas`.
+
+    :param database: The filename of the SQLite database, or a URI if
+      `uri=True` is passed in `kwargs`
+    :type database: str
+
+    :param profile: None or the name of a profile, e.g., 'bulk-load',
+      'analytical-read', or 'low-memory'
+    :type profile: Union[None,str] = None
+
+    :param pragmas: A dictionary of pragma name to value, which override the
+      profile
+    :type pragmas: Dict[str,Any] = {}
+
+    :param kwargs: Keyword arguments to pass to `sqlite3.connect`
+    :type kwargs: Dict[str,Any]
+
+    :return: A database connection object
+    :rtype: sqlite3.Connection
+    """
+
+    settings = {}
+    if profile is not None:
+        if profile not in profiles:
+            raise ValueError('unknown profile %s' % profile)
+        settings.update(profiles[profile])
+    settings.update(pragmas)
+
+    kwargs.setdefault('factory', _Connection)
+    conn = connect(database, **kwargs)
+    for n, v in settings.items():
+        conn.execute('pragma %s = %s' % (n, v))
+    return conn
+
+class ReadPool:
+    """
+    A pool of read only connections to the SQLite `database` file, one per
+    thread, opened with the pragmas of a named `profile` and `pragmas` like
+    `connection`.
+
+    The pool can be passed as `conn` to the functions of this module, and
+    it uses the connection of the calling thread, opening it the first time
+    a thread uses the pool. The connections are opened with `mode=ro`, so
+    temporary tables, e.g., for `sample2colarr`, still work.
+
+    *Note:* `shared_cache` opens the connections with `cache=shared`, which
+    shares one page cache between them, but serializes them on table locks;
+    memory mapping (`mmap_size`) shares the file pages between connections
+    without locking, therefore it's the default.
+
+    :param database: The filename of the SQLite database
+    :type database: str
+
+    :param profile: None or the name of a profile
+    :type profile: Union[None,str] = 'analytical-read'
+
+    :param pragmas: A dictionary of pragma name to value, which override the
+      profile
+    :type pragmas: Dict[str,Any] = {}
+
+    :param shared_cache: If True, use SQLite's shared cache mode
+    :type shared_cache: bool = False
+    """
+
+    def __init__(self, database, profile='analytical-read', pragmas={},
+        shared_cache=False):
+        self.database = database
+        self.profile = profile
+        self.pragmas = pragmas
+        self.shared_cache = shared_cache
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        """
+        Return the connection of the calling thread.
+
+        :return: A database connection object
+        :rtype: sqlite3.Connection
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            uri = 'file:%s?mode=ro' % urllib.parse.quote(
+                os.path.abspath(self.database))
+            if self.shared_cache:
+                uri = uri + '&cache=shared'
+            # closing the pool from another thread needs to close this one
+            conn = connection(uri, self.profile, self.pragmas, uri=True,
+                check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """
+        Close the connections of every thread.
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            for i in self._connections:
+                i.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        # cursor, execute, commit, etc. of the thread's connection
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.connection(), name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ColumnWriter:
+    """
+    Insert numpy column batches into a `table` of the SQLite `database` file
+    from any number of threads, through a single writer connection.
+
+    `write` puts a batch on a bounded queue and returns, blocking when
+    `depth` batches are already waiting, so producers can't outrun the
+    database. A writer thread merges the queued batches into transactions of
+    at least `batch_size` rows, or whatever is pending after `interval`
+    seconds, and inserts each with a single `executemany`. SQLite only
+    allows one writer, therefore this keeps the commits large no matter how
+    many threads are producing.
+
+    The table is created from the first batch if it doesn't exist, with the
+    data types that `columns2sqlite` uses. Errors on the writer thread are
+    raised by the next `write`, `flush`, or `close`.
+
+    :param database: The filename of the SQLite database
+    :type database: str
+
+    :param table: A SQL table on the database
+    :type table: str
+
+    :param batch_size: The number of rows to commit at a time
+    :type batch_size: int = 100000
+
+    :param interval: The seconds to wait for more rows before committing
+    :type interval: float = 1.0
+
+    :param depth: The number of batches that can be queued
+    :type depth: int = 16
+
+    :param timeout: The seconds the connection waits on a locked database
+    :type timeout: float = 60.0
+
+    :param profile: None or the name of a profile for `connection`, e.g.,
+      'bulk-load'
+    :type profile: Union[None,str] = None
+    """
+
+    def __init__(self, database, table, batch_size=100000, interval=1.0,
+        depth=16, timeout=60.0, profile=None):
+        self.table = table
+        self.profile = profile
+        self.batch_size = batch_size
+        self.interval = interval
+        self.rows = 0
+        self._error = None
+        self._queue = queue.Queue(depth)
+        self._thread = threading.Thread(target=self._run,
+            args=(database, timeout), daemon=True)
+        self._thread.start()
+
+    def write(self, columns):
+        """
+        Queue a batch of rows to insert.
+
+        :param columns: A list of iterables in the column order of the table,
+          or a dictionary of column name to iterables
+        :type columns: Union[List[Iterable],Dict[str,Iterable]]
+
+        :return: None
+        :rtype: None
+        """
+        self._raise()
+        if not self._thread.is_alive():
+            raise ValueError('write to a closed ColumnWriter')
+        if isinstance(columns, dict):
+            names = tuple(columns.keys())
+            columns = list(columns.values())
+        else:
+            names = None
+        columns = [numpy.asarray(i) for i in columns]
+        types = [_np_datatype[i.dtype.str] for i in columns]
+        # tolist converts to python values in bulk, off the writer thread
+        rows = list(zip(*[i.tolist() for i in columns]))
+        if not self._put((names, types, rows)):
+            self._raise()
+            raise ValueError('write to a closed ColumnWriter')
+
+    def flush(self):
+        """
+        Wait until the rows queued so far are committed.
+
+        :return: None
+        :rtype: None
+        """
+        done = threading.Event()
+        if self._put(done):
+            # the writer thread can stop before it gets to the event
+            while not done.wait(0.1) and self._thread.is_alive():
+                pass
+        self._raise()
+
+    def close(self):
+        """
+        Commit the queued rows and stop the writer thread.
+
+        :return: None
+        :rtype: None
+        """
+        self._put(None)
+        self._thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _put(self, item):
+        # False if the writer thread stopped, instead of blocking on a full
+        # queue forever
+        while self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self, database, timeout):
+        try:
+            conn = connection(database, self.profile, timeout=timeout)
+        except Exception as e:
+            self._error = e
+            return
+        cursor = conn.cursor()
+        pending = []
+        current = None
+        deadline = None
+        try:
+            while True:
+                wait = None
+                if deadline is not None:
+                    wait = max(deadline - time.monotonic(), 0)
+                try:
+                    item = self._queue.get(timeout=wait)
+                except queue.Empty:
+                    item = False
+
+                if isinstance(item, tuple) and \
+                    (current is None or item[:2] == current):
+                    current = item[:2]
+                    pending.extend(item[2])
+                    if deadline is None:
+                        deadline = time.monotonic() + self.interval
+                    if len(pending) < self.batch_size:
+                        continue
+                    item = False
+
+                if len(pending) > 0:
+                    try:
+                        self._insert(conn, cursor, current, pending)
+                        self.rows = self.rows + len(pending)
+                    except Exception as e:
+                        conn.rollback()
+                        self._error = e
+                pending = []
+                current = None
+                deadline = None
+
+                if isinstance(item, tuple):
+                    # a batch with other columns, so start a new transaction
+                    current = item[:2]
+                    pending = list(item[2])
+                    deadline = time.monotonic() + self.interval
+                elif isinstance(item, threading.Event):
+                    item.set()
+                elif item is None:
+                    return
+        except Exception as e:
+            self._error = e
+        finally:
+            conn.close()
+
+    def _insert(self, conn, cursor, current, rows):
+        names, types = current
+        if len(tableschema(conn, "'%s'" % self.table)) == 0:
+            if names is None:
+                raise ValueError('the first batch needs column names to '
+                    'create %s' % self.table)
+            cursor.execute("create table '%s' (%s)" % (self.table,
+                ", ".join("'%s' %s" % (n, t) for n, t in zip(names, types))))
+        if names is None:
+            insertstr = "insert into '%s' values (%s)" % \
+                (self.table, ", ".join("?"*len(types)))
+        else:
+            insertstr = "insert into '%s' (%s) values (%s)" % (self.table,
+                ", ".join('"%s"' % n for n in names), ", ".join("?"*len(types)))
+        cursor.executemany(insertstr, rows)
+        conn.commit()
+
+_stats = OrderedDict()
+_stats_lock = threading.Lock()
+
+def _version(conn):
+    # data_version changes on commits by other connections, total_changes on
+    # changes by this one, and schema_version on any schema change
+    return conn.execute('pragma data_version').fetchone()[0], \
+        conn.total_changes, \
+        conn.execute('pragma schema_version').fetchone()[0]
+
+def _ref(conn):
+    try:
+        return weakref.ref(conn)
+    except TypeError:
+        # a plain sqlite3.Connection can't be weakly referenced, so it's held
+        # until it's closed or evicted
+        return lambda: conn
+
+def _alive(ref):
+    conn = ref()
+    if conn is None:
+        return False
+    try:
+        conn.total_changes
+    except ProgrammingError:
+        return False
+    return True
+
+def columnstats(conn, table, fraction=None, seed=None):
+    """
+    Given a SQL DB-API 2.0, `conn`, return the count, number of NULLs, and
+    the minimum, maximum, and mean of the numeric values of every column of
+    a `table` or a SQL query, as a structured numpy array with a row per
+    column.
+
+    The statistics are computed by SQLite in a single aggregate query, i.e.,
+    the rows aren't fetched. The structured array has the fields `column`,
+    `type` (from `tableschema`, or '' for a query), `count`, `nulls`, `min`,
+    `max`, and `mean`. The numeric statistics are NaN for columns without
+    numeric values, and aren't computed for columns with text affinity.
+
+    If `fraction` is given, the statistics are estimated from a random sample
+    of the rows of `table` like `sample2colarr`, and `count` and `nulls` are
+    scaled by the inverse of `fraction`.
+
+    The results are cached for `conn` until the database or its schema
+    changes, as seen by `pragma data_version`, `pragma schema_version`, and
+    the changes of `conn`.
+
+    :param conn: A database connection object
+    :type conn: SQL DB-API 2.0 object
+
+    :param table: A SQL table on the database in `conn`, or a SQL query
+    :type table: str
+
+    :param fraction: None or the fraction of the rows of `table` to sample
+    :type fraction: Union[None,float] = None
+
+    :param seed: None or a seed for the numpy random number generator
+    :type seed: Union[None,int] = None
+
+    :return: A 1D structured numpy array with the statistics of each column
+    :rtype: 1D structured numpy.array
+    """
+
+    if isinstance(conn, ReadPool):
+        conn = conn.connection()
+    key = (id(conn), table, fraction, seed)
+    version = _version(conn)
+    with _stats_lock:
+        cached = _stats.get(key)
+        if cached is not None and cached[0]() is conn and \
+            cached[1] == version:
+            _stats.move_to_end(key)
+            return cached[2].copy()
+
+    if table in tablenames(conn):
+        schema = tableschema(conn, "'%s'" % table)
+        query = "select * from '%s'" % table
+    else:
+        if fraction is not None:
+            raise ValueError('fraction can only be used with a table')
+        query = table
+        schema = [(i[0], '') for i in conn.execute(
+            "select * from (%s) limit 0" % query).description]
+
+    aggregates = ["count(*)"]
+    for n, t in schema:
+        aggregates.append('count("%s")' % n)
+        if any(i in t for i in ['char', 'clob', 'text']):
+            aggregates.extend(['null']*3)
+        else:
+            v = "case when typeof(\"%s\") in ('integer', 'real') " \
+                "then \"%s\" end" % (n, n)
+            aggregates.extend(['min(%s)' % v, 'max(%s)' % v, 'avg(%s)' % v])
+
+    transaction = None
+    if fraction is not None:
+        query, transaction = _sample(conn, table, None, fraction, None, seed)
+    try:
+        row = conn.execute("select %s from (%s)" %
+            (", ".join(aggregates), query)).fetchone()
+    finally:
+        if transaction is not None:
+            _sample_done(conn, transaction)
+
+    scale = 1.0 if fraction is None else 1.0/fraction
+    total = row[0]
+    result = numpy.array(
+        [(n, t, round(c*scale), round((total - c)*scale),
+          numpy.nan if lo is None else lo, numpy.nan if hi is None else hi,
+          numpy.nan if mean is None else mean)
+         for (n, t), c, lo, hi, mean in zip(schema, row[1::4], row[2::4],
+            row[3::4], row[4::4])],
+        [('column', 'U%d' % max([1] + [len(n) for n, t in schema])),
+         ('type', 'U%d' % max([1] + [len(t) for n, t in schema])),
+         ('count', 'i8'), ('nulls', 'i8'), ('min', 'f8'), ('max', 'f8'),
+         ('mean', 'f8')])
+
+    with _stats_lock:
+        for k in [k for k, v in _stats.items() if not _alive(v[0])]:
+            del _stats[k]
+        # after the query, since sampling changes the temporary tables
+        _stats[key] = (_ref(conn), _version(conn), result)
+        _stats.move_to_end(key)
+        while len(_stats) > 64:
+            _stats.popitem(last=False)
+    return result.copy()
+
+def _background(rows, batch_size, depth=4):
+    # reads the rows on a thread in batches, so parsing (and decompressing)
+    # overlaps with the inserts
+    q = queue.Queue(depth)
+
+    def produce():
+        try:
+            while True:
+                batch = list(islice(rows, batch_size))
+                q.put(batch)
+                if len(batch) == 0:
+                    return
+        except BaseException as e:
+            q.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    def consume():
+        while True:
+            batch = q.get()
+            if isinstance(batch, BaseException):
+                raise batch
+            if len(batch) == 0:
+                return
+            yield from batch
+
+    return consume()
+
+class _Progress:
+    # `size` is None or a function returning the bytes read or written so far
+    def __init__(self, label, size=None, quiet=False):
+        self.label = label
+        self.size = size
+        self.quiet = quiet
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.shown = self.start
+
+    def nbytes(self):
+        if self.size is None:
+            return 0
+        return self.size()
+
+    def __call__(self, rows):
+        self.rows = rows
+        now = time.perf_counter()
+        if self.quiet or now - self.shown < 0.5:
+            return
+        self.shown = now
+        elapsed = now - self.start
+        line = '\r%s: %d rows, %.0f rows/s' % (self.label, rows, rows/elapsed)
+        if self.size is not None:
+            line = line + ', %.2f MB/s' % (self.nbytes()/elapsed/1e6)
+        sys.stderr.write(line + ' ')
+        sys.stderr.flush()
+
+    def done(self):
+        elapsed = time.perf_counter() - self.start
+        if not self.quiet and self.shown != self.start:
+            sys.stderr.write('\n')
+        return self.rows, self.nbytes(), elapsed
+
+def _import(args, conn):
+    files = []
+    failed = []
+    for i in args.files:
+        found = sorted(glob.glob(i))
+        if len(found) == 0:
+            failed.append((i, 'no files match'))
+        files.extend(found)
+    if args.table is not None and len(files) > 1:
+        raise ValueError('--table can only be used with a single file')
+
+    def start(filename):
+        try:
+            raw = open(filename, 'rb')
+        except OSError as e:
+            return filename, None, None, e
+        if filename.endswith('.gz'):
+            f = io.TextIOWrapper(gzip.GzipFile(fileobj=raw),
+                encoding=args.encoding, newline='')
+        else:
+            f = io.TextIOWrapper(raw, encoding=args.encoding, newline='')
+        rows = reader(f, delimiter=args.delimiter)
+        if args.jobs > 1:
+            rows = _background(rows, args.batch_size)
+        return filename, raw, f, rows
+
+    # up to `jobs` files are read ahead while the current one is inserted
+    summary = []
+    pending = deque()
+    todo = deque(files)
+    while len(todo) > 0 or len(pending) > 0:
+        while len(todo) > 0 and len(pending) < args.jobs:
+            pending.append(start(todo.popleft()))
+        filename, raw, f, rows = pending.popleft()
+        table = args.table
+        if table is None:
+            table = os.path.basename(filename)
+            if table.endswith('.gz'):
+                table = table[:-len('.gz')]
+            table = os.path.splitext(table)[0]
+        if raw is None:
+            failed.append((filename, str(rows)))
+            continue
+        progress = _Progress(filename, raw.tell, args.quiet)
+        try:
+            _csv2sqlite(conn, table, rows, False, None, args.batch_size,
+                progress)
+            summary.append((filename, table) + progress.done())
+        except Exception as e:
+            # the other files are still imported, and the rows of this one
+            # that weren't committed are rolled back
+            progress.done()
+            conn.rollback()
+            failed.append((filename, '%s: %s' % (type(e).__name__, e)))
+        finally:
+            f.close()
+
+    print('%-40s %-20s %12s %12s %10s %12s' %
+        ('file', 'table', 'rows', 'bytes', 'seconds', 'rows/s'))
+    for filename, table, rows, nbytes, elapsed in summary:
+        print('%-40s %-20s %12d %12d %10.2f %12.0f' %
+            (filename, table, rows, nbytes, elapsed, rows/max(elapsed, 1e-9)))
+    for filename, error in failed:
+        print('%-40s FAILED %s' % (filename, error))
+    return len(failed)
+
+def _export(args, conn):
+    if not args.output.endswith(('.csv', '.npy', '.npz')):
+        raise ValueError('the output needs to be a .csv, .npy, or .npz file')
+
+    if args.output.endswith('.csv'):
+        progress = _Progress(args.output,
+            lambda: os.path.getsize(args.output), args.quiet)
+        progress.rows = query2csv(conn, args.query, args.output,
+            progress=progress, batch_size=args.batch_size)
+    else:
+        # the rows are shown while fetching, the bytes once written
+        progress = _Progress(args.output, quiet=args.quiet)
+        columns = query2coldict(conn, args.query, progress=progress,
+            batch_size=args.batch_size)
+        progress.rows = len(next(iter(columns.values())))
+        if args.output.endswith('.npz'):
+            numpy.savez(args.output, **columns)
+        else:
+            numpy.save(args.output, numpy.rec.fromarrays(
+                list(columns.values()), names=list(columns.keys())))
+    rows, nbytes, elapsed = progress.done()
+    nbytes = os.path.getsize(args.output)
+    print('%s: %d rows, %d bytes, %.2f seconds, %.0f rows/s, %.2f MB/s' %
+        (args.output, rows, nbytes, elapsed, rows/max(elapsed, 1e-9),
+         nbytes/max(elapsed, 1e-9)/1e6))
+
+def main(argv=None):
+    """
+    The command line interface, for importing CSV files into a SQLite
+    database and exporting queries to CSV or numpy files, installed as the
+    `sqlitenumpy` command. See `sqlitenumpy --help`.
+
+    :param argv: None for `sys.argv`, or a list of command line arguments
+    :type argv: Union[None,List[str]] = None
+
+    Failed files are listed after the summary of an import, and the exit
+    status is 1 if any file or the export failed.
+
+    :return: The exit status
+    :rtype: int
+    """
+
+    parser = argparse.ArgumentParser(prog='sqlitenumpy',
+        description='Import CSV files into and export queries from SQLite.')
+    parser.add_argument('--profile', choices=sorted(profiles),
+        help='a named set of pragmas to set on the database')
+    parser.add_argument('--pragma', action='append', default=[],
+        metavar='NAME=VALUE', help='a pragma to set on the database, '
+        'e.g., journal_mode=wal; can be repeated')
+    parser.add_argument('--batch-size', type=int, default=10000,
+        help='the number of rows inserted or fetched at a time')
+    parser.add_argument('--quiet', action='store_true',
+        help="don't show the progress")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('import', help='import CSV or gzipped CSV files, '
+        'each into a table named after the file')
+    p.add_argument('database')
+    p.add_argument('files', nargs='+', help='CSV files or globs')
+    p.add_argument('--table', help='the table name, for a single file')
+    p.add_argument('--jobs', type=int, default=1,
+        help='the number of files read in parallel')
+    p.add_argument('--delimiter', default=',')
+    p.add_argument('--encoding', default='utf-8')
+
+    p = commands.add_parser('export', help='export a query to a .csv, '
+        '.npy (structured array), or .npz (column arrays) file')
+    p.add_argument('database')
+    p.add_argument('query')
+    p.add_argument('output')
+
+    args = parser.parse_args(argv)
+
+    try:
+        conn = connection(args.database, args.profile,
+            dict(i.split('=', 1) for i in args.pragma))
+        try:
+            if args.command == 'import':
+                failed = _import(args, conn)
+            else:
+                _export(args, conn)
+                failed = 0
+        finally:
+            conn.close()
+    except (ValueError, OSError, DatabaseError) as e:
+        sys.stderr.write('sqlitenumpy: error: %s\n' % e)
+        return 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
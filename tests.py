@@ -505,3 +505,770 @@ class UnitTests(TestCase):
     self.assertEqual(
       [(i == j).all() for i, j in zip(b, q)], [True, True])
 
+
+  def test_livecoldict(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'x': [1, 2, 3], 'y': [3.3, 2.2, 1.1], 'z': ['a', 'b', 'c']},
+      ['x', 'y', 'z'])
+
+    q = sn.LiveColdict(db, 'foo')
+    self.assertEqual(list(q.keys()), ['x', 'y', 'z'])
+    self.assertEqual(q.rows, 3)
+    self.assertEqual(q['x'].tolist(), [1, 2, 3])
+    self.assertEqual(q.refresh(), 0)
+
+    db.execute("insert into foo values (4, 0.0, 'dd')")
+    db.execute("insert into foo values (5, -1.1, 'e')")
+    self.assertEqual(q.refresh(), 2)
+    self.assertEqual(q.rows, 5)
+    self.assertEqual(q['x'].tolist(), [1, 2, 3, 4, 5])
+    self.assertEqual(q['y'].tolist(), [3.3, 2.2, 1.1, 0.0, -1.1])
+    self.assertEqual(q['z'].tolist(), ['a', 'b', 'c', 'dd', 'e'])
+    self.assertEqual(q['z'].dtype, '<U2')
+
+    q = sn.LiveColdict(db, 'foo', ['z', 'x'], key='x', dtypes=[None, 'i4'])
+    self.assertEqual(q.last, 5)
+    self.assertEqual(q['x'].dtype, 'i4')
+    db.execute("insert into foo values (6, 0.0, 'f')")
+    self.assertEqual(q.refresh(), 1)
+    self.assertEqual(q['z'].tolist(), ['a', 'b', 'c', 'dd', 'e', 'f'])
+    self.assertNotIn('y', q)
+
+  def test_params(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'x': [1, 2, 3], 'y': [3.3, 2.2, 1.1], 'z': ['a', 'b', 'c']},
+      ['x', 'y', 'z'])
+
+    q = sn.query2colarr(db, 'select x, z from foo where x > ? order by x',
+      params=(1,))
+    self.assertEqual([i.tolist() for i in q], [[2, 3], ['b', 'c']])
+    q = sn.query2coldict(db, 'select x from foo where z = :z',
+      params={'z': 'b'})
+    self.assertEqual(q['x'].tolist(), [2])
+    q = sn.query2array(db, 'select x, y from foo where x < ?', params=[2])
+    self.assertEqual(q.tolist(), [[1, 3.3]])
+    self.assertEqual(
+      sn.columnnames(db, 'select x as w from foo where x = ?', (3,)), ['w'])
+    self.assertRaises(ValueError,
+      sn.query2colarr, db, 'select x from foo where x > ?', params=(3,))
+
+  def test_querymany2colarr(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'x': [1, 2, 3], 'y': [3.3, 2.2, 1.1], 'z': ['a', 'b', 'c']},
+      ['x', 'y', 'z'])
+
+    qt = 'select x, z from foo where x >= ? order by x'
+    q, g = sn.querymany2colarr(db, qt, [(3,), (4,), (2,)])
+    self.assertEqual([i.tolist() for i in q], [[3, 2, 3], ['c', 'b', 'c']])
+    self.assertEqual(g.tolist(), [0, 2, 2])
+
+    q = sn.querymany2colarr(db, qt, [(3,), (4,), (2,)], split=True)
+    self.assertEqual([[i.tolist() for i in j] for j in q],
+      [[[3], ['c']], [[], []], [[2, 3], ['b', 'c']]])
+
+    q, g = sn.querymany2coldict(db, qt, [(2,), (3,)], [None, '<U2'])
+    self.assertEqual(q['x'].tolist(), [2, 3, 3])
+    self.assertEqual(q['z'].dtype, '<U2')
+    q = sn.querymany2coldict(db, qt, [(2,), (3,)], split=True)
+    self.assertEqual([i['z'].tolist() for i in q], [['b', 'c'], ['c']])
+
+    self.assertRaises(ValueError, sn.querymany2colarr, db, qt, [(4,)])
+
+  def test_sample2colarr(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+    from numpy import arange
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'x': arange(10000), 'y': arange(10000)*0.5}, ['x', 'y'])
+    db.execute('delete from foo where x % 3 = 0')
+    db.commit()
+
+    q = sn.sample2colarr(db, 'foo', n=100, seed=1)
+    self.assertEqual([len(i) for i in q], [100, 100])
+    self.assertTrue((q[0] % 3 != 0).all())
+    self.assertTrue((q[0][1:] > q[0][:-1]).all())
+    self.assertTrue((q[1] == q[0]*0.5).all())
+    self.assertFalse(db.in_transaction)
+
+    q = sn.sample2coldict(db, 'foo', fraction=0.1, columns=['y'], seed=2)
+    self.assertEqual(list(q.keys()), ['y'])
+    self.assertTrue(500 < len(q['y']) < 850)
+
+    q = sn.sample2colarr(db, 'foo', n=10**6, seed=3)
+    self.assertEqual(len(q[0]), 6666)
+
+    self.assertRaises(ValueError, sn.sample2colarr, db, 'foo')
+    self.assertRaises(ValueError, sn.sample2colarr, db, 'foo', 1, 0.5)
+
+  def test_db2npz(self):
+    from sqlite3 import connect
+    from tempfile import TemporaryDirectory
+    import os
+    import sqlitenumpy as sn
+
+    with TemporaryDirectory() as d:
+      db = connect(os.path.join(d, 'a.sqlite'))
+      sn.columns2sqlite(db, 'foo',
+        {'x': [1, 2, 3], 'y': [3.3, 2.2, 1.1], 'z': ['a', 'b', 'c c']},
+        ['x', 'y', 'z'])
+      sn.columns2sqlite(db, 'bar', {'y y': [1.5], 'x': [7]}, ['y y', 'x'])
+      db.execute('create table baz (i int, s text)')
+      db.commit()
+
+      for f in ['a.npz', 'b', 'c.npz']:
+        r = sn.db2npz(db, os.path.join(d, f), compressed=(f != 'c.npz'),
+          threads=2)
+        self.assertEqual(sorted(r), ['bar', 'baz', 'foo'])
+
+        c = connect(':memory:')
+        r = sn.npz2db(c, os.path.join(d, f))
+        self.assertEqual(r['foo'],
+          [('x', 'int'), ('y', 'real'), ('z', 'string')])
+        self.assertEqual(r['bar'], [('y y', 'real'), ('x', 'int')])
+        self.assertEqual(r['baz'], [('i', 'int'), ('s', 'text')])
+        q = sn.query2coldict(c, 'select * from foo')
+        self.assertEqual(q['z'].tolist(), ['a', 'b', 'c c'])
+        self.assertEqual(q['y'].tolist(), [3.3, 2.2, 1.1])
+        self.assertEqual(sn.columnnames(c, 'select * from bar'), ['y y', 'x'])
+
+        e = connect(':memory:')
+        self.assertEqual(sn.npz2db(e, os.path.join(d, f), ['bar']).keys(),
+          {'bar'})
+        sn.db2npz(c, os.path.join(d, 'm' + f))
+        self.assertEqual(sn.npz2db(e, os.path.join(d, 'm' + f), ['foo']),
+          {'foo': [('x', 'int'), ('y', 'real'), ('z', 'string')]})
+
+      db.execute('create table qux (k integer primary key, i int, t text, '
+        'b blob, v)')
+      db.execute('create index qux_t on qux (t)')
+      db.executemany('insert into qux values (?, ?, ?, ?, ?)',
+        [(1, 1, '007', b'\x00\x01', 1), (5, None, '1e3', b'\x01\x00', 'a'),
+         (9, 3, None, None, None)])
+      db.commit()
+      for f in ['q.npz', 'q']:
+        sn.db2npz(db, os.path.join(d, f), ['qux'], threads=1)
+        c = connect(':memory:')
+        self.assertRaises(ValueError, sn.npz2db, c, os.path.join(d, f))
+        c = connect(':memory:')
+        self.assertEqual(sn.npz2db(c, os.path.join(d, f), allow_pickle=True),
+          {'qux': [('k', 'integer'), ('i', 'int'), ('t', 'text'),
+            ('b', 'blob'), ('v', '')]})
+        self.assertEqual(c.execute('select * from qux').fetchall(),
+          db.execute('select * from qux').fetchall())
+        self.assertEqual(c.execute('select typeof(i), typeof(t) from qux '
+          'where k = 1').fetchone(), ('integer', 'text'))
+        self.assertEqual(c.execute("select name from sqlite_schema "
+          "where type = 'index'").fetchall(), [('qux_t',)])
+
+      db.execute('create table "a/b" ("x/y", ".schema", "1.2")')
+      db.executemany('insert into "a/b" values (?, ?, ?)',
+        [(1, 'x', 2.5), ('y', 3, b'z'), (4.5, 'w', 7)])
+      db.commit()
+      for f in ['s.npz', 's']:
+        sn.db2npz(db, os.path.join(d, f), ['a/b'])
+        c = connect(':memory:')
+        sn.npz2db(c, os.path.join(d, f), allow_pickle=True)
+        self.assertEqual(c.execute('select *, typeof("x/y") from "a/b"')
+          .fetchall(), db.execute('select *, typeof("x/y") from "a/b"')
+          .fetchall())
+        self.assertEqual(sn.columnnames(c, 'select * from "a/b"'),
+          ['x/y', '.schema', '1.2'])
+      db.close()
+
+  def test_max_memory(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+    from numpy import arange, memmap
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'x': arange(1000), 'y': arange(1000)*0.5}, ['x', 'y'])
+    db.execute("insert into foo values (1000, NULL)")
+    db.execute("insert into foo values ('a', 1.0)")
+    db.commit()
+
+    fetch_size = sn.fetch_size
+    sn.fetch_size = 100
+    try:
+      qt = 'select * from foo where x < 1000 order by rowid'
+      q = sn.query2coldict(db, qt)
+      self.assertEqual(sn.memoryusage(),
+        {'peak': 32000, 'rows': 1000, 'spilled': False, 'narrowed': {}})
+      seen = []
+      sn.query2colarr(db, qt, progress=seen.append)
+      self.assertEqual(seen, list(range(1, 1000, 100)) + [1000])
+      self.assertRaises(MemoryError, sn.query2coldict, db, qt,
+        max_memory=8000)
+      with self.assertRaisesRegex(MemoryError, 'bytes per row, set '):
+        sn.query2colarr(db, qt, max_memory=8000)
+      sn.count_rows = True
+      with self.assertRaisesRegex(MemoryError, 'final size of 1000 rows'):
+        sn.query2colarr(db, qt, max_memory=8000)
+      sn.count_rows = False
+
+      r = sn.query2coldict(db, qt, max_memory=8000, spill=True)
+      self.assertTrue(sn.memoryusage()['spilled'])
+      self.assertTrue(sn.memoryusage()['peak'] <= 8000)
+      self.assertTrue(isinstance(r['x'], memmap))
+      self.assertEqual([r[k].tolist() for k in r], [q[k].tolist() for k in q])
+
+      # NULLs make object chunks, which can't be spilled
+      self.assertRaises(MemoryError, sn.query2colarr, db,
+        'select x, case when x % 2 then y end from foo', max_memory=8000,
+        spill=True)
+
+      r = sn.query2array(db, 'select * from foo order by rowid',
+        max_memory=8000, spill=True)
+      self.assertEqual(r.shape, (1002, 2))
+      self.assertEqual(r[1000].tolist(), [1000, None])
+
+      sn.max_memory = 1000
+      self.assertRaises(MemoryError, sn.querymany2colarr, db,
+        'select * from foo where x < ?', [(500,), (1000,)])
+      self.assertRaises(MemoryError, sn.LiveColdict, db, 'foo')
+      sn.max_memory = None
+      m, g = sn.querymany2colarr(db, 'select x from foo where x < ?',
+        [(500,), (1000,), (0,)])
+      self.assertEqual(len(m[0]), 1500)
+      self.assertEqual(sn.memoryusage()['rows'], 1500)
+      w = sn.LiveColdict(db, 'foo', ['x'])
+      self.assertEqual(w.rows, 1002)
+      self.assertEqual(w.last, 1002)
+
+      sn.max_memory = 8000
+      sn.spill = True
+      r = sn.query2colarr(db, 'select * from foo order by rowid')
+      self.assertEqual(r[0].dtype, '<U21')
+      self.assertEqual(r[1].dtype, object)
+      self.assertEqual(r[0][-3:].tolist(), ['999', '1000', 'a'])
+      r = sn.query2struct(db, qt, [int, float])
+      self.assertTrue(sn.memoryusage()['spilled'])
+      self.assertEqual(r['y'].tolist(), q['y'].tolist())
+    finally:
+      sn.fetch_size = fetch_size
+      sn.max_memory = None
+      sn.spill = False
+      sn.count_rows = False
+
+  def test_main(self):
+    from sqlite3 import connect
+    from tempfile import TemporaryDirectory
+    from contextlib import redirect_stderr, redirect_stdout
+    from io import StringIO
+    from filecmp import cmp
+    import gzip
+    import os
+    import numpy
+    import sqlitenumpy as sn
+
+    with TemporaryDirectory() as d:
+      with open('regress/two.csv', 'rb') as f, \
+        gzip.open(os.path.join(d, 'three.csv.gz'), 'wb') as g:
+        g.write(f.read())
+      db = os.path.join(d, 'a.sqlite')
+
+      out = StringIO()
+      with redirect_stdout(out):
+        self.assertEqual(sn.main(['--quiet', '--pragma', 'journal_mode=wal',
+          'import', db, 'regress/one*.csv', os.path.join(d, '*.gz'),
+          '--jobs', '2']), 0)
+      self.assertEqual(len(out.getvalue().splitlines()), 4)
+      c = connect(db)
+      self.assertEqual(sorted(sn.tablenames(c)), ['one', 'onenoh', 'three'])
+      self.assertEqual(sn.tableschema(c, 'three'),
+        [('z', 'string'), ('y y', 'real'), ('x', 'int')])
+      c.close()
+
+      with redirect_stdout(out):
+        sn.main(['--quiet', 'export', db, 'select * from one order by x',
+          os.path.join(d, 'one.csv')])
+        sn.main(['--quiet', 'export', db, 'select * from one order by x',
+          os.path.join(d, 'one.npy')])
+      self.assertTrue(cmp(os.path.join(d, 'one.csv'), 'regress/one.csv'))
+      q = numpy.load(os.path.join(d, 'one.npy'))
+      self.assertEqual(q['y y'].tolist(), [3.3, 2.2, 1.1])
+
+      err = StringIO()
+      with redirect_stderr(err):
+        self.assertEqual(sn.main(['--quiet', 'import', db,
+          'regress/one.csv', 'regress/two.csv', '--table', 'x']), 1)
+        self.assertEqual(sn.main(['--quiet', 'export', db,
+          'select * from one where x > 100', os.path.join(d, 'none.csv')]), 1)
+      self.assertIn('empty query result', err.getvalue())
+
+      with open(os.path.join(d, 'header.csv'), 'w') as f:
+        f.write('a,b\n')
+      out = StringIO()
+      with redirect_stdout(out):
+        self.assertEqual(sn.main(['--quiet', 'import', db, 'regress/one.csv',
+          os.path.join(d, 'header.csv'), 'regress/two.csv',
+          os.path.join(d, 'missing*.csv')]), 1)
+      lines = out.getvalue().splitlines()
+      self.assertEqual(len(lines), 5)
+      self.assertIn('two.csv', lines[1])
+      self.assertIn('missing*.csv', lines[2])
+      self.assertIn('no files match', lines[2])
+      self.assertIn('one.csv', lines[3])
+      self.assertIn('already exists', lines[3])
+      self.assertIn('empty csv input', lines[4])
+      c = connect(db)
+      self.assertEqual(sn.query2colarr(c, 'select count(*) from two')[0][0],
+        3)
+      c.close()
+
+  def test_columnwriter(self):
+    from sqlite3 import connect, OperationalError
+    from tempfile import TemporaryDirectory
+    from threading import Thread
+    import os
+    import sqlitenumpy as sn
+    from numpy import arange, char
+
+    with TemporaryDirectory() as d:
+      db = os.path.join(d, 'a.sqlite')
+
+      with sn.ColumnWriter(db, 'foo', batch_size=250) as w:
+        def produce(i):
+          for j in range(10):
+            x = arange(100) + 1000*i + 100*j
+            w.write({'x': x, 'y': x*0.5, 'z': char.add('s', x.astype(str))})
+
+        threads = [Thread(target=produce, args=(i,)) for i in range(4)]
+        for t in threads:
+          t.start()
+        for t in threads:
+          t.join()
+        w.flush()
+        self.assertEqual(w.rows, 4000)
+
+        c = connect(db)
+        self.assertEqual(sn.tableschema(c, 'foo'),
+          [('x', 'int'), ('y', 'real'), ('z', 'string')])
+        q = sn.query2coldict(c, 'select * from foo order by x')
+        self.assertEqual(q['x'].tolist(), list(range(4000)))
+        self.assertEqual(q['y'].tolist(), (arange(4000)*0.5).tolist())
+        self.assertEqual(q['z'][-1], 's3999')
+
+        w.write([[5000], [1.0], ['a']])
+      self.assertEqual(w.rows, 4001)
+      self.assertRaises(ValueError, w.write, [[1], [1.0], ['b']])
+
+      w = sn.ColumnWriter(db, 'bar')
+      w.write([[1], [2]])
+      self.assertRaises(ValueError, w.flush)
+      w.write({'a': [1], 'b': [2.0]})
+      w.close()
+      self.assertEqual(sn.query2colarr(c, 'select * from bar')[1].tolist(),
+        [2.0])
+      c.close()
+
+      w = sn.ColumnWriter(os.path.join(d, 'none', 'a.sqlite'), 'foo')
+      self.assertRaises(OperationalError, w.flush)
+      self.assertRaises(ValueError, w.write, {'x': [1]})
+      w.close()
+
+  def test_query2groups(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'x': [1, 2, 3, 4, 5], 'y': [3.3, 2.2, 1.1, 0.0, -1.1],
+       'z': ['b', 'a', 'b', 'c', 'a']},
+      ['x', 'y', 'z'])
+
+    q = sn.query2groups(db, 'select * from foo order by x', 'z')
+    self.assertEqual(list(q.keys()), ['a', 'b', 'c'])
+    self.assertEqual(q['a']['x'].tolist(), [2, 5])
+    self.assertEqual(q['b']['x'].tolist(), [1, 3])
+    self.assertEqual(q['b']['y'].tolist(), [3.3, 1.1])
+    self.assertEqual(q['c']['z'].tolist(), ['c'])
+    self.assertTrue(q['a']['x'].base is q['b']['x'].base)
+
+    q = sn.query2groups(db, 'select x % 2 as p, x from foo order by p, x',
+      'p')
+    self.assertEqual(q[0]['x'].tolist(), [2, 4])
+    self.assertEqual(q[1]['x'].tolist(), [1, 3, 5])
+
+    q = sn.query2groups(db, 'select x from foo where z = ?', 'x',
+      params=('c',))
+    self.assertEqual(list(q.keys()), [4])
+
+    self.assertRaises(ValueError, sn.query2groups, db, 'select x from foo',
+      'y')
+
+    db.execute("insert into foo values (0, 9.9, NULL)")
+    db.execute("insert into foo values (6, NULL, 'a')")
+    db.commit()
+    q = sn.query2groups(db, 'select * from foo order by x', 'z')
+    self.assertEqual(list(q.keys()), ['a', 'b', 'c', None])
+    self.assertEqual(q[None]['x'].tolist(), [0])
+    self.assertEqual(q['a']['x'].tolist(), [2, 5, 6])
+
+    q = sn.query2groups(db, 'select y, x from foo order by x', 'y',
+      [float, int])
+    self.assertEqual(list(q.keys()), [-1.1, 0.0, 1.1, 2.2, 3.3, 9.9, None])
+    self.assertEqual(q[0.0]['x'].tolist(), [4])
+    self.assertEqual(q[None]['x'].tolist(), [6])
+
+    db.execute('create table bar (k, v)')
+    db.executemany('insert into bar values (?, ?)',
+      [('b', 0), (2, 1), ('a', 2), (1, 3), ('b', 4), (2.5, 5), (1, 6)])
+    db.commit()
+    q = sn.query2groups(db, 'select * from bar', 'k', [object, None])
+    self.assertEqual(list(q.keys()), [1, 2, 2.5, 'a', 'b'])
+    self.assertEqual(q['b']['v'].tolist(), [0, 4])
+    self.assertEqual(q[1]['v'].tolist(), [3, 6])
+    db.execute("insert into bar values (NULL, 7)")
+    q = sn.query2groups(db, 'select * from bar', 'k')
+    self.assertEqual(list(q.keys()), [1, 2, 2.5, 'a', 'b', None])
+    self.assertEqual(q[None]['v'].tolist(), [7])
+
+    from numpy import arange, memmap
+    sn.columns2sqlite(db, 'baz', {'k': arange(1000) % 7, 'v': arange(1000)},
+      ['k', 'v'])
+    fetch_size = sn.fetch_size
+    sn.fetch_size = 100
+    try:
+      q = sn.query2groups(db, 'select * from baz', 'k', max_memory=4000,
+        spill=True)
+    finally:
+      sn.fetch_size = fetch_size
+    self.assertTrue(isinstance(q[3]['v'], memmap))
+    self.assertEqual(q[3]['v'].tolist(), list(range(3, 1000, 7)))
+
+  def test_lazycoldict(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'x': [1, 2, 3], 'y y': [3.3, 2.2, 1.1], 'z': ['a', 'b', 'c']},
+      ['x', 'y y', 'z'])
+
+    q = sn.query2coldict(db, 'select * from foo where x > ? order by x',
+      [None, 'f4', None], params=(1,), lazy=True)
+    self.assertEqual(list(q.keys()), ['x', 'y y', 'z'])
+    self.assertEqual(q.columns, {})
+    self.assertEqual(q['z'].tolist(), ['b', 'c'])
+    self.assertEqual(list(q.columns.keys()), ['z'])
+    q.prefetch(['x', 'z', 'y y'])
+    self.assertEqual(list(q.columns.keys()), ['z', 'x', 'y y'])
+    self.assertEqual(q['y y'].dtype, 'f4')
+    self.assertEqual(q['x'].tolist(), [2, 3])
+    self.assertEqual(len(q), 3)
+    self.assertNotIn('w', q)
+    self.assertRaises(KeyError, q.prefetch, ['w'])
+
+    self.assertEqual({k: v.tolist() for k, v in q.items()},
+      {k: v.tolist() for k, v in sn.query2coldict(db,
+        'select * from foo where x > 1 order by x', [None, 'f4', None]).items()})
+
+    qt = 'select x, x*10 as x, z from foo order by x'
+    q = sn.query2coldict(db, qt, lazy=True)
+    self.assertEqual(q['x'].tolist(), sn.query2coldict(db, qt)['x'].tolist())
+    self.assertEqual(q['x'].tolist(), [10, 20, 30])
+    self.assertEqual(list(q), ['x', 'z'])
+    q = sn.query2coldict(db, 'with w as (select x from foo) select x from w '
+      'order by x desc', lazy=True)
+    self.assertEqual(q['x'].tolist(), [3, 2, 1])
+
+    q = sn.query2coldict(db, 'select x, z from foo where x > ? order by x; ',
+      params=(1,), downcast=True, lazy=True)
+    self.assertEqual(q['x'].tolist(), [2, 3])
+    self.assertEqual(sn.memoryusage()['narrowed'], {'x': '|i1'})
+
+  def test_downcast(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+    from numpy import arange, char
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'a': arange(300) % 2, 'b': arange(300) - 150, 'c': arange(300)*1000,
+       'd': arange(300)*0.5, 'e': char.add('s', arange(300).astype(str))},
+      ['a', 'b', 'c', 'd', 'e'])
+    db.execute("insert into foo values (1, 1, 1, 1e300, 'x')")
+    db.commit()
+
+    fetch_size = sn.fetch_size
+    sn.fetch_size = 100
+    try:
+      qt = 'select * from foo where rowid <= 300 order by rowid'
+      q = sn.query2coldict(db, qt, downcast=True)
+      self.assertEqual([q[k].dtype.str for k in 'abcde'],
+        ['|i1', '<i2', '<i4', '<f8', '<U4'])
+      self.assertEqual(sn.memoryusage()['narrowed'],
+        {'a': '|i1', 'b': '<i2', 'c': '<i4'})
+      self.assertEqual(q['b'].tolist(), list(range(-150, 150)))
+      self.assertEqual(q['c'][-1], 299000)
+
+      q = sn.query2colarr(db, qt, [None, 'i8', None, None, None],
+        downcast=True, float32=True)
+      self.assertEqual([i.dtype.str for i in q],
+        ['|i1', '<i8', '<i4', '<f4', '<U4'])
+      self.assertEqual(q[3][-1], 149.5)
+
+      q = sn.query2colarr(db, 'select d from foo', downcast=True,
+        float32=True, max_memory=1000, spill=True)
+      self.assertEqual(q[0].dtype.str, '<f8')
+      self.assertEqual(q[0][-1], 1e300)
+
+      q = sn.query2coldict(db, qt, downcast=True, lazy=True)
+      self.assertEqual(q['a'].dtype.str, '|i1')
+      q = sn.query2groups(db, qt, 'a', downcast=True)
+      self.assertEqual(q[1]['c'].dtype.str, '<i4')
+
+      self.assertEqual(sn.query2colarr(db, qt)[0].dtype.str, '<i8')
+      self.assertEqual(sn.memoryusage()['narrowed'], {})
+
+      sn.columns2sqlite(db, 'bar', q[1], ['a', 'b', 'c'])
+      self.assertEqual(sn.tableschema(db, 'bar'),
+        [('a', 'int'), ('b', 'int'), ('c', 'int')])
+    finally:
+      sn.fetch_size = fetch_size
+
+  def test_query2csv_format(self):
+    from sqlite3 import connect
+    from tempfile import TemporaryDirectory
+    from csv import QUOTE_ALL, writer
+    import io
+    import os
+    import sqlitenumpy as sn
+
+    db = connect(':memory:')
+    db.execute('create table foo (x, y, z)')
+    db.executemany('insert into foo values (?, ?, ?)',
+      [(1, 0.5, 'a'), (2, 1.0/3, 'b,c'), (None, 2.0, 'd "e"'),
+       (4, None, 'f\ng'), (5.5, 1e16, '')])
+
+    with TemporaryDirectory() as d:
+      f = os.path.join(d, 'a.csv')
+
+      self.assertEqual(sn.query2csv(db, 'select * from foo', f), 5)
+      with open(f, newline='') as g:
+        self.assertEqual(g.read(),
+          'x,y,z\r\n1,0.5,a\r\n2,0.3333333333333333,"b,c"\r\n'
+          ',2.0,"d ""e"""\r\n4,,"f\ng"\r\n5.5,1e+16,\r\n')
+
+      sn.query2csv(db, 'select y, z from foo', f, header_skip=True,
+        csv_options={'delimiter': ';', 'lineterminator': '\n'},
+        float_format='%.3f')
+      with open(f, newline='') as g:
+        self.assertEqual(g.read(),
+          '0.500;a\n0.333;b,c\n2.000;"d ""e"""\n;"f\ng"\n'
+          '10000000000000000.000;\n')
+
+      sn.query2csv(db, 'select z from foo where x > 4', f)
+      with open(f, newline='') as g:
+        self.assertEqual(g.read(), 'z\r\n""\r\n')
+
+      sn.query2csv(db, 'select x, z from foo where x < 3', f,
+        csv_options={'quoting': QUOTE_ALL})
+      with open(f, newline='') as g:
+        self.assertEqual(g.read(), '"x","z"\r\n"1","a"\r\n"2","b,c"\r\n')
+      self.assertRaises(ValueError, sn.query2csv, db, 'select * from foo',
+        f, csv_options={'quoting': QUOTE_ALL}, float_format='%.3f')
+
+      # the same output as csv.writer, including a carriage return that
+      # isn't in the lineterminator, and numbers with the delimiter in them
+      db.execute('insert into foo values (?, ?, ?)', (6, 7.25, 'h\ri'))
+      for options in [{'lineterminator': '\n'}, {'delimiter': '.'},
+                      {'delimiter': '1', 'quotechar': "'"}]:
+        for query in ['select * from foo', 'select y, 2*y from foo where y > 1',
+                      'select x, 7 from foo where x < 3']:
+          sn.query2csv(db, query, f, csv_options=options)
+          with open(f, newline='') as g:
+            expected = io.StringIO()
+            out = writer(expected, **options)
+            cursor = db.execute(query)
+            out.writerow([d[0] for d in cursor.description])
+            out.writerows(cursor)
+            self.assertEqual(g.read(), expected.getvalue())
+
+  def test_readpool(self):
+    from tempfile import TemporaryDirectory
+    from threading import Thread
+    import os
+    import sqlitenumpy as sn
+
+    with TemporaryDirectory() as d:
+      db = os.path.join(d, 'a b.sqlite')
+
+      c = sn.connection(db, 'bulk-load', {'cache_size': -1000})
+      self.assertEqual(c.execute('pragma journal_mode').fetchone()[0], 'wal')
+      self.assertEqual(c.execute('pragma synchronous').fetchone()[0], 0)
+      self.assertEqual(c.execute('pragma cache_size').fetchone()[0], -1000)
+      sn.columns2sqlite(c, 'foo',
+        {'x': [1, 2, 3], 'y': [3.3, 2.2, 1.1], 'z': ['a', 'b', 'c']},
+        ['x', 'y', 'z'])
+      c.close()
+      self.assertRaises(ValueError, sn.connection, db, 'fast')
+
+      with sn.ReadPool(db) as p:
+        self.assertEqual(p.execute('pragma temp_store').fetchone()[0], 2)
+        self.assertEqual(sn.query2coldict(p, 'select * from foo order by x')
+          ['z'].tolist(), ['a', 'b', 'c'])
+        self.assertEqual(len(sn.sample2colarr(p, 'foo', 2)[0]), 2)
+        self.assertRaises(Exception, p.execute, 'delete from foo')
+
+        r = {}
+        def read(i):
+          r[i] = (p.connection(), sn.query2colarr(p, 'select count(*) from foo'))
+        threads = [Thread(target=read, args=(i,)) for i in range(3)]
+        for t in threads:
+          t.start()
+        for t in threads:
+          t.join()
+        self.assertEqual(len({id(i[0]) for i in r.values()}), 3)
+        self.assertEqual([i[1][0][0] for i in r.values()], [3, 3, 3])
+        self.assertTrue(p.connection() is p.connection())
+
+  def test_columnstats(self):
+    from sqlite3 import connect
+    import sqlitenumpy as sn
+    from numpy import arange, isnan
+
+    db = connect(':memory:')
+
+    sn.columns2sqlite(db, 'foo',
+      {'x': [1, 2, 3], 'y y': [3.5, 2.0, 0.5], 'z': ['a', 'b', 'c']},
+      ['x', 'y y', 'z'])
+    db.execute("insert into foo values (NULL, 'n/a', NULL)")
+    db.execute("create table bar (t text, i integer)")
+    db.execute("insert into bar values ('1', 1)")
+    db.commit()
+
+    q = sn.columnstats(db, 'foo')
+    self.assertEqual(q['column'].tolist(), ['x', 'y y', 'z'])
+    self.assertEqual(q['type'].tolist(), ['int', 'real', 'string'])
+    self.assertEqual(q['count'].tolist(), [3, 4, 3])
+    self.assertEqual(q['nulls'].tolist(), [1, 0, 1])
+    self.assertEqual(q['min'][:2].tolist(), [1.0, 0.5])
+    self.assertEqual(q['max'][:2].tolist(), [3.0, 3.5])
+    self.assertEqual(q['mean'][:2].tolist(), [2.0, 2.0])
+    self.assertTrue(isnan(q['mean'][2]))
+
+    q['count'] = 0
+    self.assertEqual(sn.columnstats(db, 'foo')['count'].tolist(), [3, 4, 3])
+    db.execute("insert into foo values (5, 1.0, 'd')")
+    self.assertEqual(sn.columnstats(db, 'foo')['count'].tolist(), [4, 5, 4])
+
+    q = sn.columnstats(db, 'bar')
+    self.assertTrue(isnan(q['min'][0]))
+    self.assertEqual(q['min'][1], 1.0)
+
+    q = sn.columnstats(db, 'select x*2 as w from foo where x > 1')
+    self.assertEqual(q['type'].tolist(), [''])
+    self.assertEqual(q[['count', 'min', 'max']].tolist(), [(3, 4.0, 10.0)])
+    self.assertRaises(ValueError, sn.columnstats, db, 'select x from foo',
+      0.5)
+
+    sn.columns2sqlite(db, 'baz', {'x': arange(10000)}, ['x'])
+    q = sn.columnstats(db, 'baz', fraction=0.1, seed=1)
+    self.assertTrue(8000 < q['count'][0] < 12000)
+    self.assertTrue(4000 < q['mean'][0] < 6000)
+    self.assertEqual(sn.columnstats(db, 'baz', fraction=0.1, seed=1)
+      ['count'].tolist(), q['count'].tolist())
+
+    db.execute('create table u (a)')
+    db.execute('insert into u values (1)')
+    db.commit()
+    self.assertEqual(sn.columnstats(db, 'u')['count'].tolist(), [1])
+    db.execute('alter table u add column w')
+    self.assertEqual(sn.columnstats(db, 'u')['column'].tolist(), ['a', 'w'])
+    db.execute('drop table u')
+    db.execute('create table u (a, b)')
+    self.assertEqual(sn.columnstats(db, 'u')['count'].tolist(), [0, 0])
+
+    from tempfile import TemporaryDirectory
+    from gc import collect
+    from weakref import ref
+    import os
+    with TemporaryDirectory() as d:
+      c = sn.connection(os.path.join(d, 'a.sqlite'))
+      sn.columns2sqlite(c, 'foo', {'x': [1, 2]}, ['x'])
+      sn.columnstats(c, 'foo')
+      self.assertTrue(any(v[0]() is c for v in sn._stats.values()))
+      r = ref(c)
+      c.close()
+      del c
+      collect()
+      self.assertIsNone(r())
+
+  def test_shared(self):
+    from sqlite3 import connect
+    from pickle import dumps, loads
+    from subprocess import run
+    import os
+    import sys
+    import sqlitenumpy as sn
+
+    db = connect(':memory:')
+    sn.columns2sqlite(db, 'foo',
+      {'x': list(range(100)), 'y': [i/2 for i in range(100)],
+       'z': ['s%d' % i for i in range(100)]}, ['x', 'y', 'z'])
+
+    with sn.query2coldict(db, 'select * from foo', shared=True) as q:
+      self.assertEqual(list(q), ['x', 'y', 'z'])
+      w = loads(dumps(q))
+      self.assertEqual(w['x'].tolist(), list(range(100)))
+      self.assertEqual(w['y'][3], 1.5)
+      self.assertEqual(w['z'][7], 's7')
+      w['x'][0] = 42
+      self.assertEqual(q['x'][0], 42)
+      w.close()
+
+    # a process with a resource tracker of its own
+    script = 'import pickle, sys; import sqlitenumpy as sn; ' \
+      'q = pickle.load(sys.stdin.buffer); print(q["x"].sum()); q.close()'
+    with sn.query2coldict(db, 'select * from foo', shared=True) as q:
+      for i in range(2):
+        r = run([sys.executable, '-c', script], input=dumps(q),
+          capture_output=True, cwd=os.path.dirname(os.path.abspath(sn.__file__)))
+        self.assertEqual(r.stdout.strip(), b'4950')
+        self.assertNotIn(b'leaked', r.stderr)
+      self.assertEqual(loads(dumps(q))['x'][99], 99)
+    self.assertRaises(FileNotFoundError, lambda: loads(dumps(q))['x'])
+
+    fetch_size = sn.fetch_size
+    sn.fetch_size = 7
+    try:
+      with sn.query2colarr(db, 'select x, x*2 as x from foo', shared=True,
+        downcast=True) as q:
+        a = q.arrays()
+        self.assertEqual(len(q), 1)
+        self.assertEqual(q['x'].tolist(), [2*i for i in range(100)])
+        self.assertEqual(a[0].dtype.itemsize, 1)
+        del a
+    finally:
+      sn.fetch_size = fetch_size
+
+    db.execute("insert into foo values (NULL, 0.0, 'a')")
+    self.assertRaises(ValueError, sn.query2colarr, db, 'select x from foo',
+      shared=True)
+    self.assertRaises(ValueError, sn.query2coldict, db, 'select x from foo',
+      shared=True, lazy=True)
+